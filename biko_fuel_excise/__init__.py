@@ -1,3 +1,10 @@
+from odoo import SUPERUSER_ID, api
+
 from . import models
 from . import wizards
 from . import reports
+
+
+def post_init_hook(cr, registry):
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env["stock.quant"]._biko_reconcile_quantity_15c()
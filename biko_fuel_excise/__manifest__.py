@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     "name": "BIKO: Модуль добавляет логику работы с ",
-    "version": "15.0.1.1.6",
+    "version": "15.0.1.3.0",
     "author": "Borovlev A.S.",
     "company": "BIKO Solutions",
     "depends": [
@@ -9,18 +9,34 @@
         "purchase",
         "stock",
         "sale_stock",
+        "mail",
     ],
+    "external_dependencies": {
+        "python": ["numpy"],
+    },
     "data": [
+        "data/ir_cron_data.xml",
+        "data/stock_quant_data.xml",
         "views/sale_order_views.xml",
         "views/purchase_order_views.xml",
         "views/stock_picking_views.xml",
         "views/stock_move_views.xml",
         "views/account_move_views.xml",
         "views/stock_production_lot_views.xml",
+        "views/stock_quant_views.xml",
         "reports/report_stock15c_moves_views.xml",
+        "reports/report_stock15c_moves_session_views.xml",
+        "reports/report_stock15c_moves_detail_views.xml",
         "wizards/stock_15c_moves_wizard_views.xml",
         "security/ir.model.access.csv",
+        "security/stock_15c_security.xml",
     ],
+    "assets": {
+        "web.assets_backend": [
+            "biko_fuel_excise/static/src/js/stock_15c_report_notification.js",
+        ],
+    },
+    "post_init_hook": "post_init_hook",
     "license": "LGPL-3",
     "installable": True,
     "application": True,
@@ -0,0 +1,7 @@
+from odoo import SUPERUSER_ID, api
+
+
+def migrate(cr, version):
+    # fill stock_quant.biko_quantity_15c from the existing move lines
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env["stock.quant"]._biko_reconcile_quantity_15c()
@@ -0,0 +1,30 @@
+def migrate(cr, version):
+    # the lot densities are now rounded when stored, round the existing ones
+    # so that the density lookups match them
+    cr.execute(
+        """
+        update stock_production_lot
+        set biko_density_15c = round(biko_density_15c::numeric, 4)
+        where biko_density_15c != round(biko_density_15c::numeric, 4)
+        """
+    )
+    # mark the density lots before the unique index on them is created, the
+    # lookups used the oldest lot of a density, the others stay as plain lots
+    cr.execute(
+        """
+        alter table stock_production_lot
+        add column if not exists biko_is_density_lot boolean
+        """
+    )
+    cr.execute(
+        """
+        update stock_production_lot
+        set biko_is_density_lot = true
+        where id in (
+            select min(id)
+            from stock_production_lot
+            where biko_density_15c > 0
+            group by company_id, product_id, biko_density_15c
+        )
+        """
+    )
@@ -1,4 +1,6 @@
+from . import sale_order
 from . import sale_order_line
+from . import purchase_order
 from . import purchase_order_line
 from . import stock_move_line
 from . import stock_move
@@ -6,3 +8,5 @@ from . import account_move_line
 from . import stock_rule
 from . import procurement_group
 from . import stock_production_lot
+from . import stock_15c_balance_snapshot
+from . import stock_quant
@@ -0,0 +1,30 @@
+from odoo import api, models
+
+from .purchase_order_line import BIKO_DEFER_PICKING_UPDATES
+
+
+class PurchaseOrder(models.Model):
+    _inherit = "purchase.order"
+
+    def _create_picking(self):
+        # resolve the density lots of all the confirmed orders in one go
+        # instead of order by order
+        self.order_line._biko_assign_density_lots()
+        return super(PurchaseOrder, self)._create_picking()
+
+    # the lines written by an order save or an import update their pickings
+    # once per order at the end
+    def write(self, values):
+        res = super(
+            PurchaseOrder, self.with_context(**{BIKO_DEFER_PICKING_UPDATES: True})
+        ).write(values)
+        self.env["purchase.order.line"]._biko_flush_picking_updates()
+        return res
+
+    @api.model
+    def load(self, fields, data):
+        res = super(
+            PurchaseOrder, self.with_context(**{BIKO_DEFER_PICKING_UPDATES: True})
+        ).load(fields, data)
+        self.env["purchase.order.line"]._biko_flush_picking_updates()
+        return res
@@ -1,12 +1,30 @@
 # -*- coding: utf-8 -*-
+from collections import defaultdict
+
 from odoo import models, fields, api
 from odoo.tools.float_utils import float_compare, float_is_zero, float_round
 
+from ..tools import volume_correction
+
+PURCHASE_LINES_TO_UPDATE = "biko_fuel_excise.purchase_lines_to_update"
+# context key deferring the picking updates of the written lines to an
+# explicit _biko_flush_picking_updates
+BIKO_DEFER_PICKING_UPDATES = "biko_defer_picking_updates"
+
 
 class PurchaseOrderLine(models.Model):
     _inherit = "purchase.order.line"
 
     biko_density_fact = fields.Float(string="Density", digits=(6, 4))
+    biko_temperature = fields.Float(
+        string="Temperature, C",
+        digits=(4, 1),
+        help="Temperature at which the density was measured, used when it is marked as measured.",
+    )
+    biko_temperature_measured = fields.Boolean(
+        string="Temperature Measured",
+        help="Derive the density at 15 C from the density measured at the temperature.",
+    )
     biko_qty_kg = fields.Float(
         string="Quantity, kg",
         digits="Product Unit of Measure",
@@ -20,22 +38,43 @@ class PurchaseOrderLine(models.Model):
     biko_lot_id = fields.Many2one("stock.production.lot", "Lot", copy=False)
 
     # Form view methods
-    @api.onchange("product_qty", "biko_density_fact")
+    @api.onchange(
+        "product_qty",
+        "biko_density_fact",
+        "biko_temperature",
+        "biko_temperature_measured",
+    )
     def _onchange_calculate_qty_kg(self):
-        for rec in self:
-            rec.biko_qty_kg = rec.product_qty * rec.biko_density_fact
-            if rec.biko_density_15c:
-                rec.biko_product_qty_15c = rec.biko_qty_kg / rec.biko_density_15c
-            else:
-                rec.biko_product_qty_15c = 0.0
+        # with a temperature, the density at 15 C is derived from the
+        # observed one instead of being typed in
+        temperatures = [
+            line.biko_temperature if line.biko_temperature_measured else float("nan")
+            for line in self
+        ]
+        conversion = volume_correction.convert(
+            self.mapped("product_qty"),
+            self.mapped("biko_density_fact"),
+            [
+                0.0 if line.biko_temperature_measured else line.biko_density_15c
+                for line in self
+            ],
+            temperatures,
+        )
+        for rec, kg_qty, qty_15c, density_15c in zip(
+            self, conversion.mass, conversion.volume_15c, conversion.density_15c
+        ):
+            rec.biko_qty_kg = float(kg_qty)
+            if rec.biko_temperature_measured:
+                rec.biko_density_15c = float(density_15c)
+            rec.biko_product_qty_15c = float(qty_15c)
 
     @api.onchange("biko_density_15c")
     def _onchange_calculate_qty_15c(self):
-        for rec in self:
-            if rec.biko_density_15c:
-                rec.biko_product_qty_15c = rec.biko_qty_kg / rec.biko_density_15c
-            else:
-                rec.biko_product_qty_15c = 0.0
+        qties_15c = volume_correction.mass_to_volume_15c(
+            self.mapped("biko_qty_kg"), self.mapped("biko_density_15c")
+        )
+        for rec, qty_15c in zip(self, qties_15c):
+            rec.biko_product_qty_15c = float(qty_15c)
 
     # Stock methods
     def _get_qty_15c_procurement(self):
@@ -52,6 +91,39 @@ class PurchaseOrderLine(models.Model):
             )
         return qty_15c
 
+    def _biko_assign_density_lots(self):
+        """Set the lot matching their density at 15 C on the stockable lines
+        without one, finding or creating the lots of all lines at once."""
+        lines = self.filtered(
+            lambda l: not l.biko_lot_id
+            and not l.display_type
+            and l.product_id.type in ["product", "consu"]
+        )
+        if not lines:
+            return
+        Lot = self.env["stock.production.lot"]
+        line_keys = [
+            (
+                line,
+                (
+                    line.company_id.id,
+                    line.product_id.id,
+                    Lot._biko_normalize_density(line.biko_density_15c),
+                ),
+            )
+            for line in lines
+        ]
+        lots = Lot._biko_get_density_lots(key for line, key in line_keys)
+        lines_by_lot = defaultdict(lambda: self.browse())
+        for line, key in line_keys:
+            lines_by_lot[lots[key]] |= line
+        for lot, lot_lines in lines_by_lot.items():
+            lot_lines.biko_lot_id = lot
+
+    def _create_stock_moves(self, picking):
+        self._biko_assign_density_lots()
+        return super(PurchaseOrderLine, self)._create_stock_moves(picking)
+
     def _prepare_stock_moves(self, picking):
         """Prepare the stock moves data for one order line. This function returns a list of
         dictionary ready to be used in stock.move's create()
@@ -145,38 +217,18 @@ class PurchaseOrderLine(models.Model):
         )
 
         if not self.biko_lot_id:
-            # search for existing lot
-            # in stock.production.lot
-            # search fields: product_id, biko_density_15
-            res_lots = self.env["stock.production.lot"].search(
-                [
-                    ("product_id", "=", self.product_id.id),
-                    ("biko_density_15c", "=", self.biko_density_15c),
-                ],
-                limit=1,
+            self.biko_lot_id = self.env[
+                "stock.production.lot"
+            ]._biko_get_density_lot(
+                self.company_id, self.product_id, self.biko_density_15c
             )
 
-            if res_lots:
-                lot_id = res_lots[0]
-            else:
-                # create lot with biko_density_15
-                lot_id = self.env["stock.production.lot"].create(
-                    {
-                        "product_id": self.product_id.id,
-                        "biko_density_15c": self.biko_density_15c,
-                        "company_id": self.company_id.id,
-                        "name": str(self.biko_density_15c),
-                    }
-                )
-        else:
-            lot_id = self.biko_lot_id
-
-        self.biko_lot_id = lot_id
-
         res.update(
             {
                 "biko_density_fact": self.biko_density_fact,
                 "biko_density_15c": self.biko_density_15c,
+                "biko_temperature": self.biko_temperature,
+                "biko_temperature_measured": self.biko_temperature_measured,
                 "biko_product_qty_15c": biko_product_qty_15c,
                 "restrict_lot_id": self.biko_lot_id.id,
                 "biko_kg_qty_15c": self.biko_qty_kg,
@@ -222,10 +274,53 @@ class PurchaseOrderLine(models.Model):
         )
         return res
 
+    def _biko_defer_picking_update(self):
+        """Update the pickings of the lines at the next
+        ``_biko_flush_picking_updates``, together with all the other lines
+        deferred meanwhile, or at the end of the transaction at the latest."""
+        if not self:
+            return
+        data = self.env.cr.precommit.data
+        if PURCHASE_LINES_TO_UPDATE not in data:
+            data[PURCHASE_LINES_TO_UPDATE] = set()
+            self.env.cr.precommit.add(self.browse()._biko_flush_picking_updates)
+        data[PURCHASE_LINES_TO_UPDATE].update(self.ids)
+
+    @api.model
+    def _biko_flush_picking_updates(self):
+        """Update the pickings of all the deferred lines, order by order."""
+        line_ids = self.env.cr.precommit.data.pop(PURCHASE_LINES_TO_UPDATE, None)
+        if not line_ids:
+            return
+        lines = self.browse(sorted(line_ids)).exists().filtered(
+            lambda l: l.order_id.state == "purchase"
+        )
+        lines._biko_assign_density_lots()
+        lines_by_order = defaultdict(lambda: self.browse())
+        for line in lines:
+            lines_by_order[line.order_id] |= line
+        for order_lines in lines_by_order.values():
+            order_lines._create_or_update_picking()
+        # may run as a precommit hook, after the last flush of the transaction
+        self.flush()
+
     # Global object's methods
     def write(self, values):
+        if "biko_product_qty_15c" not in values:
+            return super(PurchaseOrderLine, self).write(values)
         lines = self.filtered(lambda l: l.order_id.state == "purchase")
         result = super(PurchaseOrderLine, self).write(values)
-        if "biko_product_qty_15c" in values:
-            lines._create_or_update_picking()
+        lines._biko_defer_picking_update()
+        # the callers writing the lines in many calls (imports, order saves)
+        # flush once at their end, see BIKO_DEFER_PICKING_UPDATES
+        if lines and not self._context.get(BIKO_DEFER_PICKING_UPDATES):
+            self._biko_flush_picking_updates()
         return result
+
+    @api.model
+    def load(self, fields, data):
+        res = super(
+            PurchaseOrderLine, self.with_context(**{BIKO_DEFER_PICKING_UPDATES: True})
+        ).load(fields, data)
+        self._biko_flush_picking_updates()
+        return res
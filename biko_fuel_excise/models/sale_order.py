@@ -0,0 +1,24 @@
+from odoo import api, models
+
+from .sale_order_line import BIKO_DEFER_STOCK_RULES
+
+
+class SaleOrder(models.Model):
+    _inherit = "sale.order"
+
+    # the lines written by an order save or an import launch their stock
+    # rules in a single run at the end
+    def write(self, values):
+        res = super(
+            SaleOrder, self.with_context(**{BIKO_DEFER_STOCK_RULES: True})
+        ).write(values)
+        self.env["sale.order.line"]._biko_flush_stock_rules()
+        return res
+
+    @api.model
+    def load(self, fields, data):
+        res = super(
+            SaleOrder, self.with_context(**{BIKO_DEFER_STOCK_RULES: True})
+        ).load(fields, data)
+        self.env["sale.order.line"]._biko_flush_stock_rules()
+        return res
@@ -2,11 +2,31 @@
 from odoo import models, fields, api
 from odoo.tools.float_utils import float_compare
 
+from odoo.addons.sale_stock.models.sale_order import (
+    SaleOrderLine as SaleStockOrderLine,
+)
+
+from ..tools import volume_correction
+
+SALE_LINES_TO_PROCURE = "biko_fuel_excise.sale_lines_to_procure"
+# context key deferring the stock rules of the written lines to an explicit
+# _biko_flush_stock_rules
+BIKO_DEFER_STOCK_RULES = "biko_defer_stock_rules"
+
 
 class SaleOrderLine(models.Model):
     _inherit = "sale.order.line"
 
     biko_density_fact = fields.Float(string="Density", digits=(6, 4))
+    biko_temperature = fields.Float(
+        string="Temperature, C",
+        digits=(4, 1),
+        help="Temperature at which the density was measured, used when it is marked as measured.",
+    )
+    biko_temperature_measured = fields.Boolean(
+        string="Temperature Measured",
+        help="Derive the density at 15 C from the density measured at the temperature.",
+    )
     biko_lot_id = fields.Many2one(
         "stock.production.lot",
         "Lot",
@@ -49,31 +69,53 @@ class SaleOrderLine(models.Model):
     )
 
     # Form view methods
-    @api.onchange("product_uom_qty", "biko_density_fact")
+    @api.onchange(
+        "product_uom_qty",
+        "biko_density_fact",
+        "biko_temperature",
+        "biko_temperature_measured",
+    )
     def _onchange_product_uom_qty(self):
-        for rec in self:
-            rec.biko_kg_qty = rec.product_uom_qty * rec.biko_density_fact
-            if rec.biko_density_15c:
-                rec.biko_product_qty_15c = rec.biko_kg_qty / rec.biko_density_15c
-            else:
-                rec.biko_product_qty_15c = 0.0
+        # the density at 15 C comes from the lot, the temperature is only used
+        # for lines whose lot has no density
+        conversion = volume_correction.convert(
+            self.mapped("product_uom_qty"),
+            self.mapped("biko_density_fact"),
+            self.mapped("biko_density_15c"),
+            [
+                line.biko_temperature
+                if line.biko_temperature_measured
+                else float("nan")
+                for line in self
+            ],
+        )
+        for rec, kg_qty, qty_15c in zip(self, conversion.mass, conversion.volume_15c):
+            rec.biko_kg_qty = float(kg_qty)
+            rec.biko_product_qty_15c = float(qty_15c)
 
     @api.onchange("biko_density_15c")
     def _onchange_calculate_qty_15c(self):
-        for rec in self:
-            if rec.biko_density_15c:
-                rec.biko_product_qty_15c = rec.biko_kg_qty / rec.biko_density_15c
-            else:
-                rec.biko_product_qty_15c = 0.0
+        qties_15c = volume_correction.mass_to_volume_15c(
+            self.mapped("biko_kg_qty"), self.mapped("biko_density_15c")
+        )
+        for rec, qty_15c in zip(self, qties_15c):
+            rec.biko_product_qty_15c = float(qty_15c)
 
     @api.depends(
         "invoice_lines.move_id.state",
+        "invoice_lines.product_uom_id",
         "invoice_lines.biko_product_qty_15c",
-        "untaxed_amount_to_invoice",
     )
     def _compute_qty_15c_invoiced(self):
+        # the accrual date filters the invoice lines on their date, new lines
+        # have nothing in the database yet: both go through the ORM
+        if self._context.get("accrual_entry_date"):
+            orm_lines = self
+        else:
+            orm_lines = self.filtered(lambda l: not l.id)
+        (self - orm_lines)._compute_qty_15c_invoiced_sql()
 
-        for line in self:
+        for line in orm_lines:
             qty_invoiced = 0.0
             for invoice_line in line._get_invoice_lines():
                 if (
@@ -90,6 +132,47 @@ class SaleOrderLine(models.Model):
                         )
             line.biko_qty_15c_invoiced = qty_invoiced
 
+    def _compute_qty_15c_invoiced_sql(self):
+        """Sum the invoiced 15C quantities of the lines in a single query,
+        grouped by invoice UoM, and convert each group once."""
+        if not self:
+            return
+        self.env["account.move.line"].flush(
+            ["move_id", "product_uom_id", "biko_product_qty_15c", "sale_line_ids"]
+        )
+        self.env["account.move"].flush(["state", "payment_state", "move_type"])
+        self.env.cr.execute(
+            """
+            select
+                rel.order_line_id,
+                aml.product_uom_id,
+                sum(
+                    case when am.move_type = 'out_refund' then -1 else 1 end
+                    * coalesce(aml.biko_product_qty_15c, 0)
+                ) as qty
+            from sale_order_line_invoice_rel as rel
+            join account_move_line as aml on (aml.id = rel.invoice_line_id)
+            join account_move as am on (am.id = aml.move_id)
+            where rel.order_line_id in %s
+                and am.move_type in ('out_invoice', 'out_refund')
+                and (am.state != 'cancel' or am.payment_state = 'invoicing_legacy')
+            group by rel.order_line_id, aml.product_uom_id
+            """,
+            (tuple(self.ids),),
+        )
+        rows = self.env.cr.fetchall()
+        uoms = self.env["uom.uom"].browse({row[1] for row in rows if row[1]})
+        uoms = {uom.id: uom for uom in uoms}
+        qties = dict.fromkeys(self.ids, 0.0)
+        for line_id, uom_id, qty in rows:
+            line = self.browse(line_id)
+            uom = uoms.get(uom_id)
+            qties[line_id] += (
+                uom._compute_quantity(qty, line.product_uom) if uom else qty
+            )
+        for line in self:
+            line.biko_qty_15c_invoiced = qties[line.id]
+
     @api.depends(
         "biko_qty_15c_invoiced",
         "biko_qty_15c_deliv",
@@ -119,28 +202,92 @@ class SaleOrderLine(models.Model):
         "move_ids.biko_product_qty_15c",
     )
     def _compute_biko_qty_15c_deliv(self):
+        lines = self.filtered(lambda l: l.qty_delivered_method == "stock_move")
+        (self - lines).biko_qty_15c_deliv = 0.0
+        # same split as _compute_qty_15c_invoiced
+        if self._context.get("accrual_entry_date"):
+            orm_lines = lines
+        else:
+            orm_lines = lines.filtered(lambda l: not l.id)
+        (lines - orm_lines)._compute_biko_qty_15c_deliv_sql()
 
-        for line in self:
-            if line.qty_delivered_method == "stock_move":
-                qty = 0.0
-                outgoing_moves, incoming_moves = line._get_outgoing_incoming_moves()
-                for move in outgoing_moves:
-                    if move.state != "done":
-                        continue
-                    qty += move.product_uom._compute_quantity(
-                        move.biko_product_qty_15c,
-                        line.product_uom,
-                        rounding_method="HALF-UP",
-                    )
-                for move in incoming_moves:
-                    if move.state != "done":
-                        continue
-                    qty -= move.product_uom._compute_quantity(
-                        move.biko_product_qty_15c,
-                        line.product_uom,
-                        rounding_method="HALF-UP",
+        for line in orm_lines:
+            qty = 0.0
+            outgoing_moves, incoming_moves = line._get_outgoing_incoming_moves()
+            for move in outgoing_moves:
+                if move.state != "done":
+                    continue
+                qty += move.product_uom._compute_quantity(
+                    move.biko_product_qty_15c,
+                    line.product_uom,
+                    rounding_method="HALF-UP",
+                )
+            for move in incoming_moves:
+                if move.state != "done":
+                    continue
+                qty -= move.product_uom._compute_quantity(
+                    move.biko_product_qty_15c,
+                    line.product_uom,
+                    rounding_method="HALF-UP",
+                )
+            line.biko_qty_15c_deliv = qty
+
+    def _compute_biko_qty_15c_deliv_sql(self):
+        """Sum the delivered 15C quantities of the lines in a single query,
+        grouped by move UoM and direction, with the outgoing and incoming
+        rules of ``_get_outgoing_incoming_moves``."""
+        if not self:
+            return
+        self.flush(["product_id"])
+        self.env["stock.move"].flush(
+            [
+                "sale_line_id",
+                "product_id",
+                "product_uom",
+                "location_dest_id",
+                "state",
+                "scrapped",
+                "origin_returned_move_id",
+                "to_refund",
+                "biko_product_qty_15c",
+            ]
+        )
+        self.env.cr.execute(
+            """
+            select
+                sm.sale_line_id,
+                sm.product_uom,
+                dest.usage = 'customer' as outgoing,
+                sum(coalesce(sm.biko_product_qty_15c, 0)) as qty
+            from stock_move as sm
+            join sale_order_line as sol on (sol.id = sm.sale_line_id)
+            join stock_location as dest on (dest.id = sm.location_dest_id)
+            where sm.sale_line_id in %s
+                and sm.state = 'done'
+                and sm.product_id = sol.product_id
+                and not coalesce(sm.scrapped, false)
+                and (
+                    (
+                        dest.usage = 'customer'
+                        and (sm.origin_returned_move_id is null or sm.to_refund)
                     )
-                line.biko_qty_15c_deliv = qty
+                    or (dest.usage != 'customer' and sm.to_refund)
+                )
+            group by sm.sale_line_id, sm.product_uom, dest.usage = 'customer'
+            """,
+            (tuple(self.ids),),
+        )
+        rows = self.env.cr.fetchall()
+        uoms = self.env["uom.uom"].browse({row[1] for row in rows})
+        uoms = {uom.id: uom for uom in uoms}
+        qties = dict.fromkeys(self.ids, 0.0)
+        for line_id, uom_id, outgoing, qty in rows:
+            qty = uoms[uom_id]._compute_quantity(
+                qty, self.browse(line_id).product_uom, rounding_method="HALF-UP"
+            )
+            qties[line_id] += qty if outgoing else -qty
+        for line in self:
+            line.biko_qty_15c_deliv = qties[line.id]
 
     # Stock methods
     def _prepare_procurement_values(self, group_id=False):
@@ -155,6 +302,8 @@ class SaleOrderLine(models.Model):
             {
                 "biko_density_fact": self.biko_density_fact,
                 "biko_density_15c": self.biko_density_15c,
+                "biko_temperature": self.biko_temperature,
+                "biko_temperature_measured": self.biko_temperature_measured,
                 "biko_product_qty_15c": self.biko_product_qty_15c,
                 "biko_kg_qty_15c": self.biko_kg_qty,
                 "restrict_lot_id": self.biko_lot_id.id,
@@ -162,25 +311,49 @@ class SaleOrderLine(models.Model):
         )
         return values
 
-    def _get_qty_procurement(
-        self, previous_product_uom_qty=False, field_name="product_uom_qty"
+    def _get_qty_procurement_multi(
+        self,
+        field_names=("product_uom_qty", "biko_product_qty_15c"),
+        previous_product_uom_qty=False,
     ):
-        self.ensure_one()
-        qty = 0.0
-        outgoing_moves, incoming_moves = self._get_outgoing_incoming_moves()
-        for move in outgoing_moves:
-            qty += move.product_uom._compute_quantity(
-                move[field_name], self.product_uom, rounding_method="HALF-UP"
-            )
-        for move in incoming_moves:
-            qty -= move.product_uom._compute_quantity(
-                move[field_name], self.product_uom, rounding_method="HALF-UP"
-            )
-        return qty
+        """Return the quantities of the lines already procured, in each of
+        the move quantity ``field_names``, walking the moves of every line
+        only once. When ``_get_qty_procurement`` is overridden (e.g. for the
+        kits of sale_mrp), it still gives the ``product_uom_qty`` one.
 
-    def _action_launch_stock_rule(
-        self, previous_product_uom_qty=False, previos_qty_15=False
-    ):
+        :return: dict ``{line_id: {field_name: qty}}``
+        """
+        # load the moves of all the lines at once, instead of line by line
+        self.mapped("move_ids.location_dest_id")
+        use_hook = "product_uom_qty" in field_names and (
+            type(self)._get_qty_procurement
+            is not SaleStockOrderLine._get_qty_procurement
+        )
+        move_field_names = [
+            field_name
+            for field_name in field_names
+            if not (use_hook and field_name == "product_uom_qty")
+        ]
+        result = {}
+        for line in self:
+            qties = dict.fromkeys(field_names, 0.0)
+            outgoing_moves, incoming_moves = line._get_outgoing_incoming_moves()
+            for moves, sign in ((outgoing_moves, 1), (incoming_moves, -1)):
+                for move in moves:
+                    for field_name in move_field_names:
+                        qties[field_name] += sign * move.product_uom._compute_quantity(
+                            move[field_name],
+                            line.product_uom,
+                            rounding_method="HALF-UP",
+                        )
+            if use_hook:
+                qties["product_uom_qty"] = line._get_qty_procurement(
+                    previous_product_uom_qty
+                )
+            result[line.id] = qties
+        return result
+
+    def _action_launch_stock_rule(self, previous_product_uom_qty=False):
         """
         Тут пришлось переделать запуск правил, чтобы передавать значение
         количества топлива в 15 градусов.
@@ -193,14 +366,15 @@ class SaleOrderLine(models.Model):
             "Product Unit of Measure"
         )
         procurements = []
+        procured_qties = self.filtered(
+            lambda l: l.state == "sale" and l.product_id.type in ("consu", "product")
+        )._get_qty_procurement_multi(previous_product_uom_qty=previous_product_uom_qty)
         for line in self:
             line = line.with_company(line.company_id)
             if line.state != "sale" or not line.product_id.type in ("consu", "product"):
                 continue
-            qty = line._get_qty_procurement(previous_product_uom_qty)
-            qty_15c = line._get_qty_procurement(
-                previos_qty_15, field_name="biko_product_qty_15c"
-            )
+            qty = procured_qties[line.id]["product_uom_qty"]
+            qty_15c = procured_qties[line.id]["biko_product_qty_15c"]
             # стандартно метод проеряет количнство товара на изменение.
             # т.к. у нас теперь два поля, то добавил проверку на изменение второго поля
             if (
@@ -282,20 +456,45 @@ class SaleOrderLine(models.Model):
         )
         return res
 
+    def _biko_defer_stock_rules(self):
+        """Launch the stock rules of the lines at the next
+        ``_biko_flush_stock_rules``, together with all the other lines
+        deferred meanwhile, or at the end of the transaction at the latest."""
+        data = self.env.cr.precommit.data
+        if SALE_LINES_TO_PROCURE not in data:
+            data[SALE_LINES_TO_PROCURE] = set()
+            self.env.cr.precommit.add(self.browse()._biko_flush_stock_rules)
+        data[SALE_LINES_TO_PROCURE].update(self.ids)
+
+    @api.model
+    def _biko_flush_stock_rules(self):
+        """Launch the stock rules of all the deferred lines in one run."""
+        line_ids = self.env.cr.precommit.data.pop(SALE_LINES_TO_PROCURE, None)
+        if not line_ids:
+            return
+        self.browse(list(line_ids)).exists()._action_launch_stock_rule()
+        # may run as a precommit hook, after the last flush of the transaction
+        self.flush()
+
     # Global object's methods
     def write(self, values):
         lines = self.env["sale.order.line"]
         if "biko_product_qty_15c" in values:
             lines = self.filtered(lambda r: r.state == "sale" and not r.is_expense)
-
-        previous_product_uom_qty_15 = {
-            line.id: line.biko_product_qty_15c for line in lines
-        }
         res = super(SaleOrderLine, self).write(values)
         if lines:
-            lines._action_launch_stock_rule(
-                previous_product_uom_qty=False,
-                previos_qty_15=previous_product_uom_qty_15,
-            )
+            lines._biko_defer_stock_rules()
+            # the callers writing the lines in many calls (imports, order
+            # saves) flush once at their end, see BIKO_DEFER_STOCK_RULES
+            if not self._context.get(BIKO_DEFER_STOCK_RULES):
+                self._biko_flush_stock_rules()
+
+        return res
 
+    @api.model
+    def load(self, fields, data):
+        res = super(
+            SaleOrderLine, self.with_context(**{BIKO_DEFER_STOCK_RULES: True})
+        ).load(fields, data)
+        self._biko_flush_stock_rules()
         return res
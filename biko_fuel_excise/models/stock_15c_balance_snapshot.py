@@ -0,0 +1,223 @@
+import logging
+import threading
+import time
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models, tools
+
+_logger = logging.getLogger(__name__)
+
+
+class Stock15CBalanceSnapshot(models.Model):
+    """15C balances of the internal locations of a company, as of the
+    beginning of ``date`` (i.e. the sum of all done move lines dated
+    before it). Used by the 15C moves report as a starting point, so that
+    opening balances only need the moves made after the snapshot."""
+
+    _name = "stock.15c.balance.snapshot"
+    _description = "Stock 15C Balance Snapshot"
+    _order = "date desc, id"
+
+    date = fields.Date(required=True, readonly=True)
+    company_id = fields.Many2one("res.company", "Company", required=True, readonly=True)
+    location_id = fields.Many2one("stock.location", "Location", readonly=True)
+    product_id = fields.Many2one("product.product", "Product", readonly=True)
+    lot_id = fields.Many2one("stock.production.lot", "Lot", readonly=True)
+    quantity = fields.Float("Quantity at 15 C", readonly=True)
+
+    def init(self):
+        tools.create_index(
+            self._cr,
+            "stock_15c_balance_snapshot_company_id_date_index",
+            self._table,
+            ["company_id", "date"],
+        )
+
+    @api.model
+    def _get_snapshot_date(self, company, date):
+        """Return the date of the latest snapshot of ``company`` taken on or
+        before ``date``, or None."""
+        self.flush(["company_id", "date"])
+        self.env.cr.execute(
+            """
+            select max(date)
+            from stock_15c_balance_snapshot
+            where company_id = %s and date <= %s
+            """,
+            (company.id, date),
+        )
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _build_snapshot(self, company, date):
+        """(Re)build the snapshot of ``company`` for ``date`` from the previous
+        snapshot and the move lines done since then."""
+        start_time = time.time()
+        previous_date = self._get_snapshot_date(company, date - relativedelta(days=1))
+        self.env["stock.move.line"].flush(
+            [
+                "product_id",
+                "lot_id",
+                "location_id",
+                "location_dest_id",
+                "date",
+                "state",
+                "biko_product_qty_15c_done",
+            ]
+        )
+        self.env.cr.execute(
+            "delete from stock_15c_balance_snapshot where company_id = %s and date = %s",
+            (company.id, date),
+        )
+        self.env.cr.execute(
+            """
+            insert into stock_15c_balance_snapshot (
+                date,
+                company_id,
+                location_id,
+                product_id,
+                lot_id,
+                quantity,
+                create_uid,
+                create_date,
+                write_uid,
+                write_date
+            )
+            with
+                locations as (
+                    select id
+                    from stock_location
+                    where company_id = %(company_id)s and usage = 'internal'
+                ),
+                balances as (
+                    select
+                        side.location_id,
+                        sml.product_id,
+                        sml.lot_id,
+                        side.qty
+                    from stock_move_line as sml
+                    cross join lateral (
+                        values
+                            (sml.location_dest_id, sml.biko_product_qty_15c_done),
+                            (sml.location_id, -sml.biko_product_qty_15c_done)
+                    ) as side (location_id, qty)
+                    where sml.state = 'done'
+                        and sml.date < %(date)s
+                        and (%(previous_date)s is null or sml.date >= %(previous_date)s)
+                        and (
+                            sml.location_id in (select id from locations)
+                            or sml.location_dest_id in (select id from locations)
+                        )
+                        and side.location_id in (select id from locations)
+                    union all
+                    select
+                        snapshot.location_id,
+                        snapshot.product_id,
+                        snapshot.lot_id,
+                        snapshot.quantity
+                    from stock_15c_balance_snapshot as snapshot
+                    where snapshot.company_id = %(company_id)s
+                        and snapshot.date = %(previous_date)s
+                        and snapshot.location_id in (select id from locations)
+                )
+            select
+                %(date)s,
+                %(company_id)s,
+                location_id,
+                product_id,
+                lot_id,
+                sum(qty),
+                %(user_id)s,
+                now() at time zone 'UTC',
+                %(user_id)s,
+                now() at time zone 'UTC'
+            from balances
+            group by location_id, product_id, lot_id
+            having sum(qty) != 0
+            """,
+            {
+                "company_id": company.id,
+                "date": date,
+                "previous_date": previous_date,
+                "user_id": self.env.uid,
+            },
+        )
+        _logger.info(
+            "Stock 15C balance snapshot of %s for %s (from %s): %s rows in %.3f s",
+            company.name,
+            date,
+            previous_date or "the beginning",
+            self.env.cr.rowcount,
+            time.time() - start_time,
+        )
+        self.invalidate_cache()
+
+    @api.model
+    def _invalidate_snapshots(self, companies, date):
+        """Drop the snapshots of ``companies`` that include moves dated on or
+        after ``date``, the next cron run rebuilds the ones the retention
+        keeps (see :meth:`_get_dates_to_build`)."""
+        self.env.cr.execute(
+            "delete from stock_15c_balance_snapshot where company_id in %s and date > %s",
+            (tuple(companies.ids), date),
+        )
+        self.invalidate_cache()
+
+    @api.model
+    def _get_keep_from(self, today):
+        """Return the first day of the daily snapshots kept, i.e. of the last
+        ``biko_fuel_excise.snapshot_keep_days`` days. Before it, only the
+        snapshots taken on the first day of a month are kept."""
+        keep_days = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("biko_fuel_excise.snapshot_keep_days", 62)
+        )
+        return today - relativedelta(days=keep_days)
+
+    @api.model
+    def _get_dates_to_build(self, company, today):
+        """Return the dates of the snapshots of ``company`` to (re)build, in
+        order: today's and the retained ones missing since the latest
+        snapshot, which were dropped by a back-dated move."""
+        last_date = self._get_snapshot_date(company, today - relativedelta(days=1))
+        if not last_date:
+            return [today]
+        keep_from = self._get_keep_from(today)
+        dates = []
+        date = last_date + relativedelta(days=1)
+        while date < today:
+            if date >= keep_from or date.day == 1:
+                dates.append(date)
+            date += relativedelta(days=1)
+        dates.append(today)
+        return dates
+
+    @api.model
+    def _prune_snapshots(self, company, today):
+        """Keep the snapshots of the last ``biko_fuel_excise.snapshot_keep_days``
+        days and the ones taken on the first day of a month."""
+        self.env.cr.execute(
+            """
+            delete from stock_15c_balance_snapshot
+            where company_id = %s
+                and date < %s
+                and extract(day from date) != 1
+            """,
+            (company.id, self._get_keep_from(today)),
+        )
+
+    @api.model
+    def _cron_build_snapshots(self):
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        today = fields.Date.today()
+        for company in self.env["res.company"].search([]):
+            # each snapshot starts from the previous one, build them in order
+            for date in self._get_dates_to_build(company, today):
+                self._build_snapshot(company, date)
+                if auto_commit:
+                    self.env.cr.commit()
+            self._prune_snapshots(company, today)
+            if auto_commit:
+                self.env.cr.commit()
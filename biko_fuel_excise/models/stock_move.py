@@ -2,6 +2,11 @@ from collections import defaultdict
 
 from odoo import _, api, exceptions, models, fields
 from odoo.exceptions import UserError
+from odoo.tools.float_utils import float_compare, float_is_zero, float_round
+
+from odoo.addons.stock.models.stock_quant import StockQuant
+
+from ..tools import volume_correction
 
 
 class StockMove(models.Model):
@@ -11,6 +16,15 @@ class StockMove(models.Model):
     biko_density_15c = fields.Float(
         string="Density at 15 C", digits=(6, 4), default=0.0
     )
+    biko_temperature = fields.Float(
+        string="Temperature, C",
+        digits=(4, 1),
+        help="Temperature at which the density was measured, used when it is marked as measured.",
+    )
+    biko_temperature_measured = fields.Boolean(
+        string="Temperature Measured",
+        help="Derive the density at 15 C from the density measured at the temperature.",
+    )
     biko_product_qty_15c = fields.Float(string="Quantity at 15 C", default=0.0)
 
     biko_kg_qty_15c = fields.Float(
@@ -35,6 +49,31 @@ class StockMove(models.Model):
         "stock.production.lot", string="Restrict Lot", copy=False
     )
 
+    @api.onchange(
+        "product_uom_qty",
+        "biko_density_fact",
+        "biko_temperature",
+        "biko_temperature_measured",
+    )
+    def _onchange_biko_temperature(self):
+        # the density at 15 C carried by the move (from the lot) wins, the
+        # temperature is only used for moves without one
+        moves = self.filtered("biko_temperature_measured")
+        if not moves:
+            return
+        conversion = volume_correction.convert(
+            moves.mapped("product_uom_qty"),
+            moves.mapped("biko_density_fact"),
+            moves.mapped("biko_density_15c"),
+            moves.mapped("biko_temperature"),
+        )
+        for move, kg_qty, qty_15c, density_15c in zip(
+            moves, conversion.mass, conversion.volume_15c, conversion.density_15c
+        ):
+            move.biko_kg_qty_15c = float(kg_qty)
+            move.biko_density_15c = float(density_15c)
+            move.biko_product_qty_15c = float(qty_15c)
+
     @api.model
     def _prepare_merge_moves_distinct_fields(self):
         distinct_fields = super(StockMove, self)._prepare_merge_moves_distinct_fields()
@@ -66,59 +105,69 @@ class StockMove(models.Model):
         "picking_type_id.show_reserved",
     )
     def _quantity_15c_done_compute(self):
-
-        if not any(self._ids):
-            # onchange
-            for move in self:
-                quantity_15c_done = 0
-                for move_line in move._get_move_lines():
-                    quantity_15c_done += move_line.biko_product_qty_15c_done
-                move.biko_product_qty_15c_done = quantity_15c_done
-        else:
-            # compute
-            move_lines_ids = set()
-            for move in self:
-                move_lines_ids |= set(move._get_move_lines().ids)
-
-            data = self.env["stock.move.line"].read_group(
-                [("id", "in", list(move_lines_ids))],
-                ["move_id", "biko_product_qty_15c_done"],
-                ["move_id"],
-                lazy=False,
+        # onchange: the move lines are only in the cache
+        new_moves = self.filtered(lambda m: not m.id)
+        for move in new_moves:
+            move.biko_product_qty_15c_done = sum(
+                move._get_move_lines().mapped("biko_product_qty_15c_done")
             )
 
-            rec = defaultdict(list)
-            for d in data:
-                rec[d["move_id"][0]] += [(d["biko_product_qty_15c_done"])]
-
-            for move in self:
-                move.biko_product_qty_15c_done = sum(
-                    biko_product_qty_15c_done
-                    for biko_product_qty_15c_done in rec.get(
-                        move.ids[0] if move.ids else move.id, []
-                    )
+        moves = self - new_moves
+        if not moves:
+            return
+        self.env["stock.move.line"].flush(
+            ["move_id", "biko_product_qty_15c_done", "product_qty", "qty_done"]
+        )
+        self.env["stock.move"].flush(["picking_type_id"])
+        self.env["stock.picking.type"].flush(["show_reserved"])
+        # same lines as _get_move_lines(): all of them when the operation
+        # type shows the reservation, the "nosuggest" ones otherwise
+        self.env.cr.execute(
+            """
+            select sml.move_id, sum(sml.biko_product_qty_15c_done)
+            from stock_move_line as sml
+            join stock_move as sm on (sm.id = sml.move_id)
+            left join stock_picking_type as spt on (spt.id = sm.picking_type_id)
+            where sml.move_id in %s
+                and (
+                    coalesce(spt.show_reserved, false)
+                    or sml.product_qty = 0
+                    or sml.qty_done != 0
                 )
+            group by sml.move_id
+            """,
+            (tuple(moves.ids),),
+        )
+        quantities = dict(self.env.cr.fetchall())
+        for move in moves:
+            move.biko_product_qty_15c_done = quantities.get(move.id) or 0.0
 
     def _quantity_15c_done_set(self):
-        # any call to create will invalidate `move.quantity_done`
-        quantity_15c_done = self[0].biko_product_qty_15c_done
-        for move in self:
+        # any call to create will invalidate `move.biko_product_qty_15c_done`,
+        # read the quantities of all the moves first
+        quantities_15c_done = [(move, move.biko_product_qty_15c_done) for move in self]
+        new_move_lines_vals = []
+        lines_by_quantity = defaultdict(lambda: self.env["stock.move.line"])
+        for move, quantity_15c_done in quantities_15c_done:
             move_lines = move._get_move_lines()
             if not move_lines:
                 if quantity_15c_done:
                     # do not impact reservation here
-                    move_line = self.env["stock.move.line"].create(
+                    new_move_lines_vals.append(
                         dict(
                             move._prepare_move_line_vals(),
                             biko_product_qty_15c_done=quantity_15c_done,
                         )
                     )
-                    move.write({"move_line_ids": [(4, move_line.id)]})
-                    move_line._apply_putaway_strategy()
             elif len(move_lines) == 1:
-                move_lines[0].biko_product_qty_15c_done = quantity_15c_done
+                lines_by_quantity[quantity_15c_done] |= move_lines
             else:
-                move._multi_line_quantity_done_set(quantity_15c_done)
+                move._multi_line_quantity_15c_done_set(quantity_15c_done)
+        for quantity_15c_done, move_lines in lines_by_quantity.items():
+            move_lines.biko_product_qty_15c_done = quantity_15c_done
+        if new_move_lines_vals:
+            move_lines = self.env["stock.move.line"].create(new_move_lines_vals)
+            move_lines._apply_putaway_strategy()
 
     def _multi_line_quantity_15c_done_set(self, quantity_15c_done):
         move_lines = self._get_move_lines()
@@ -175,6 +224,8 @@ class StockMove(models.Model):
             {
                 "biko_density_fact": self.biko_density_fact,
                 "biko_density_15c": self.biko_density_15c,
+                "biko_temperature": self.biko_temperature,
+                "biko_temperature_measured": self.biko_temperature_measured,
                 "biko_product_qty_15c": self.biko_product_qty_15c,
                 "biko_kg_qty_15c": self.biko_kg_qty_15c,
                 "restrict_lot_id": self.restrict_lot_id.id,
@@ -185,6 +236,8 @@ class StockMove(models.Model):
     def _set_quantities_to_reservation(self):
         super(StockMove, self)._set_quantities_to_reservation()
 
+        # one write per distinct quantity, so the moves are recomputed once
+        lines_by_quantity = defaultdict(lambda: self.env["stock.move.line"])
         for move in self:
             if move.state not in ("partially_available", "assigned"):
                 continue
@@ -193,7 +246,189 @@ class StockMove(models.Model):
                     move_line.lot_id or move_line.lot_name
                 ):
                     continue
-                move_line.biko_product_qty_15c_done = move_line.biko_product_qty_15c
+                quantity_15c = move_line.biko_product_qty_15c
+                if move_line.biko_product_qty_15c_done != quantity_15c:
+                    lines_by_quantity[quantity_15c] |= move_line
+        for quantity_15c, move_lines in lines_by_quantity.items():
+            move_lines.biko_product_qty_15c_done = quantity_15c
+
+    def _action_assign(self):
+        # lot restricted moves are reserved in batch, the others one by one
+        batch_moves = self._biko_get_batch_reservation_moves()
+        if batch_moves:
+            batch_moves._biko_batch_reserve()
+        moves = self - batch_moves
+
+        # the moves of a wave restricted to the same lot read the available
+        # quantity of its quants once, see _get_available_quantity
+        if moves._biko_get_availability_cache() is not None:
+            return super(StockMove, moves)._action_assign()
+        cache = {}
+        try:
+            return super(
+                StockMove, moves.with_context(biko_availability_cache=cache)
+            )._action_assign()
+        finally:
+            # the records created meanwhile keep the context, make sure they
+            # do not use the cache after the reservation
+            cache.clear()
+            cache["closed"] = True
+
+    def _biko_get_batch_reservation_moves(self):
+        """Return the moves reserved by ``_biko_batch_reserve`` rather than by
+        the standard per-move reservation: lot restricted moves taking
+        their product from stock, with nothing reserved yet.
+
+        The batch reservation replaces ``_update_reserved_quantity`` of the
+        moves and the quants, it is not used when another module overrides
+        them."""
+        if not int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("biko_fuel_excise.batch_reservation", 1)
+        ):
+            return self.browse()
+        if (
+            type(self)._update_reserved_quantity
+            is not StockMove._update_reserved_quantity
+            or type(self.env["stock.quant"])._update_reserved_quantity
+            is not StockQuant._update_reserved_quantity
+        ):
+            return self.browse()
+        return self.filtered(
+            lambda m: m.restrict_lot_id
+            and m.state == "confirmed"
+            and m.procure_method == "make_to_stock"
+            and not m.move_orig_ids
+            and not m.move_line_ids
+            and not m.package_level_id
+            and not m.restrict_partner_id
+            and m.product_uom == m.product_id.uom_id
+            and m.product_id.type == "product"
+            and m.has_tracking == "lot"
+            and not m.location_id.should_bypass_reservation()
+        )
+
+    def _biko_batch_reserve(self):
+        """Reserve the moves by ``(product, location, lot)``: the quants of
+        each group are gathered once and shared out among its moves in
+        order, then the move lines of all the moves are created at once.
+
+        Like ``_update_reserved_quantity``, a group never reserves more than
+        its available quantity, netting the negative quants, and a move gets
+        one line per location, lot, package and owner of its reserved
+        quants."""
+        Quant = self.env["stock.quant"]
+        moves_by_key = defaultdict(lambda: self.browse())
+        for move in self:
+            moves_by_key[
+                (move.product_id, move.location_id, move.restrict_lot_id)
+            ] |= move
+
+        move_lines_vals = []
+        reserved_by_quant = defaultdict(float)
+        assigned_moves = self.browse()
+        partially_available_moves = self.browse()
+        for (product, location, lot), moves in moves_by_key.items():
+            rounding = product.uom_id.rounding
+            available_quantity = Quant._get_available_quantity(
+                product, location, lot_id=lot, strict=False
+            )
+            quants = Quant._gather(product, location, lot_id=lot, strict=False)
+            available_by_quant = [
+                [quant, quant.quantity - quant.reserved_quantity]
+                for quant in quants
+                if float_compare(
+                    quant.quantity - quant.reserved_quantity,
+                    0,
+                    precision_rounding=rounding,
+                )
+                > 0
+            ]
+            for move in moves:
+                need = move.product_uom._compute_quantity(
+                    move.product_uom_qty, product.uom_id, rounding_method="HALF-UP"
+                )
+                to_take = min(need, available_quantity)
+                taken_quantity = 0.0
+                # [reserved quant, quantity] by move line
+                line_quantities = {}
+                for quant_available in available_by_quant:
+                    quant, available = quant_available
+                    if float_compare(to_take, 0, precision_rounding=rounding) <= 0:
+                        break
+                    quantity = float_round(
+                        min(to_take, available),
+                        precision_rounding=rounding,
+                        rounding_method="DOWN",
+                    )
+                    if float_is_zero(quantity, precision_rounding=rounding):
+                        continue
+                    # the lines get the lot of the move, the ones of quants
+                    # without lot are not merged, as by _update_reserved_quantity
+                    line_key = (
+                        (quant.location_id, quant.package_id, quant.owner_id)
+                        if quant.lot_id == lot
+                        else quant
+                    )
+                    line_quantities.setdefault(line_key, [quant, 0.0])[1] += quantity
+                    reserved_by_quant[quant] += quantity
+                    quant_available[1] -= quantity
+                    to_take -= quantity
+                    taken_quantity += quantity
+                if float_is_zero(taken_quantity, precision_rounding=rounding):
+                    continue
+                available_quantity -= taken_quantity
+                for quant, quantity in line_quantities.values():
+                    move_lines_vals.append(
+                        move._prepare_move_line_vals(
+                            quantity=quantity, reserved_quant=quant
+                        )
+                    )
+                if (
+                    float_compare(need, taken_quantity, precision_rounding=rounding)
+                    <= 0
+                ):
+                    assigned_moves |= move
+                else:
+                    partially_available_moves |= move
+
+        for quant, quantity in reserved_by_quant.items():
+            quant.reserved_quantity += quantity
+        move_lines = self.env["stock.move.line"].create(move_lines_vals)
+        partially_available_moves.write({"state": "partially_available"})
+        assigned_moves.write({"state": "assigned"})
+
+        cache = self._biko_get_availability_cache()
+        if cache:
+            products = {product.id for product, location, lot in moves_by_key}
+            for key in [k for k in cache if k[0] in products]:
+                del cache[key]
+        if not self._context.get("bypass_entire_pack"):
+            (assigned_moves | partially_available_moves).picking_id._check_entire_pack()
+        move_lines._apply_putaway_strategy()
+
+    def _biko_get_availability_cache(self):
+        """Return the available quantities cached for the current
+        ``_action_assign`` by ``_biko_availability_key``, or None outside of
+        it."""
+        cache = self._context.get("biko_availability_cache")
+        if cache is None or cache.get("closed"):
+            return None
+        return cache
+
+    def _biko_availability_key(
+        self, location_id, lot_id, package_id, owner_id, strict, allow_negative
+    ):
+        return (
+            self.product_id.id,
+            location_id.id,
+            lot_id.id if lot_id else None,
+            package_id.id if package_id else None,
+            owner_id.id if owner_id else None,
+            strict,
+            allow_negative,
+        )
 
     def _get_available_quantity(
         self,
@@ -207,14 +442,29 @@ class StockMove(models.Model):
         self.ensure_one()
         if not lot_id and self.restrict_lot_id:
             lot_id = self.restrict_lot_id
-        return super()._get_available_quantity(
-            location_id,
-            lot_id=lot_id,
-            package_id=package_id,
-            owner_id=owner_id,
-            strict=strict,
-            allow_negative=allow_negative,
+        cache = self._biko_get_availability_cache()
+        if cache is None or location_id.should_bypass_reservation():
+            return super()._get_available_quantity(
+                location_id,
+                lot_id=lot_id,
+                package_id=package_id,
+                owner_id=owner_id,
+                strict=strict,
+                allow_negative=allow_negative,
+            )
+        key = self._biko_availability_key(
+            location_id, lot_id, package_id, owner_id, strict, allow_negative
         )
+        if key not in cache:
+            cache[key] = super()._get_available_quantity(
+                location_id,
+                lot_id=lot_id,
+                package_id=package_id,
+                owner_id=owner_id,
+                strict=strict,
+                allow_negative=allow_negative,
+            )
+        return cache[key]
 
     def _update_reserved_quantity(
         self,
@@ -229,7 +479,7 @@ class StockMove(models.Model):
         self.ensure_one()
         if self.restrict_lot_id:
             lot_id = self.restrict_lot_id
-        return super()._update_reserved_quantity(
+        taken_quantity = super()._update_reserved_quantity(
             need,
             available_quantity,
             location_id,
@@ -238,6 +488,18 @@ class StockMove(models.Model):
             owner_id=owner_id,
             strict=strict,
         )
+        cache = self._biko_get_availability_cache()
+        if cache and taken_quantity:
+            key = self._biko_availability_key(
+                location_id, lot_id, package_id, owner_id, strict, False
+            )
+            # other keys of the product may share the reserved quants, they
+            # are read again when needed
+            for other_key in [k for k in cache if k[0] == key[0] and k != key]:
+                del cache[other_key]
+            if key in cache:
+                cache[key] -= taken_quantity
+        return taken_quantity
 
     def _split(self, qty, restrict_partner_id=False):
         vals_list = super()._split(qty, restrict_partner_id=restrict_partner_id)
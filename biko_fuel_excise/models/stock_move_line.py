@@ -1,4 +1,17 @@
-from odoo import _, api, models, fields
+from collections import defaultdict
+
+from odoo import _, api, models, fields, tools
+
+QUANT_15C_FIELDS = (
+    "product_id",
+    "lot_id",
+    "location_id",
+    "location_dest_id",
+    "package_id",
+    "result_package_id",
+    "owner_id",
+    "biko_product_qty_15c_done",
+)
 
 
 class StockMoveLine(models.Model):
@@ -16,3 +29,101 @@ class StockMoveLine(models.Model):
     biko_product_qty_15c_done = fields.Float(
         string="Quantity at 15 C Done", default=0.0, copy=False
     )
+
+    def init(self):
+        super(StockMoveLine, self).init()
+        # used by the 15C moves report to scan the lines of a period
+        tools.create_index(
+            self._cr,
+            "stock_move_line_location_id_date_index",
+            self._table,
+            ["location_id", "date"],
+        )
+        tools.create_index(
+            self._cr,
+            "stock_move_line_location_dest_id_date_index",
+            self._table,
+            ["location_dest_id", "date"],
+        )
+        # pages of the 15C moves detail report, see stock.15c.moves.detail
+        tools.create_index(
+            self._cr, "stock_move_line_date_id_index", self._table, ["date", "id"]
+        )
+        # last change of the company lines, part of the report session key
+        tools.create_index(
+            self._cr,
+            "stock_move_line_company_id_write_date_index",
+            self._table,
+            ["company_id", "write_date"],
+        )
+
+    def write(self, vals):
+        if any(
+            fname in vals
+            for fname in (
+                "date",
+                "product_id",
+                "lot_id",
+                "location_id",
+                "location_dest_id",
+                "biko_product_qty_15c_done",
+            )
+        ):
+            done_lines = self.filtered(lambda ml: ml.state == "done")
+            if done_lines:
+                dates = done_lines.mapped("date")
+                if vals.get("date"):
+                    dates.append(fields.Datetime.to_datetime(vals["date"]))
+                self.env["stock.15c.balance.snapshot"].sudo()._invalidate_snapshots(
+                    done_lines.company_id, min(dates).date()
+                )
+
+        quant_lines = self.env["stock.move.line"]
+        if any(fname in vals for fname in QUANT_15C_FIELDS):
+            quant_lines = self.filtered(lambda ml: ml.state == "done")
+            quant_lines._update_quant_quantity_15c(sign=-1)
+        res = super(StockMoveLine, self).write(vals)
+        quant_lines._update_quant_quantity_15c()
+        return res
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        move_lines = super(StockMoveLine, self).create(vals_list)
+        move_lines.filtered(
+            lambda ml: ml.state == "done"
+        )._update_quant_quantity_15c()
+        return move_lines
+
+    def _action_done(self):
+        res = super(StockMoveLine, self)._action_done()
+        # lines without done quantity are unlinked by the super call
+        self.exists()._update_quant_quantity_15c()
+        return res
+
+    def _update_quant_quantity_15c(self, sign=1):
+        """Move the 15C done quantity of the lines from their source quants to
+        their destination quants (or back, with ``sign=-1``)."""
+        quantities = defaultdict(float)
+        for ml in self:
+            if ml.product_id.type != "product" or not ml.biko_product_qty_15c_done:
+                continue
+            qty = sign * ml.biko_product_qty_15c_done
+            quantities[
+                (ml.product_id, ml.location_id, ml.lot_id, ml.package_id, ml.owner_id)
+            ] -= qty
+            quantities[
+                (
+                    ml.product_id,
+                    ml.location_dest_id,
+                    ml.lot_id,
+                    ml.result_package_id,
+                    ml.owner_id,
+                )
+            ] += qty
+
+        Quant = self.env["stock.quant"].sudo()
+        for (product, location, lot, package, owner), qty in quantities.items():
+            if qty:
+                Quant._update_quantity_15c(
+                    product, location, qty, lot_id=lot, package_id=package, owner_id=owner
+                )
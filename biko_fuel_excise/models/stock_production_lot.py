@@ -1,8 +1,205 @@
 # добавить в модель stock.production.lot поле biko_density_15c. тип float
-from odoo import fields, models
+import psycopg2
+from psycopg2 import errorcodes
+
+from odoo import _, api, fields, models, tools
+from odoo.tools import mute_logger
+from odoo.tools.float_utils import float_repr, float_round
+
+DENSITY_15C_DIGITS = 4
+DENSITY_LOT_UNIQUE_INDEX = "stock_production_lot_biko_density_15c_unique_index"
+# violated when the same density lot is created by two transactions: the names
+# of the created lots are free among the visible lots, a clash on the name is
+# with a lot created concurrently as well (and usually reported first)
+DENSITY_LOT_CONSTRAINTS = (
+    DENSITY_LOT_UNIQUE_INDEX,
+    "stock_production_lot_name_ref_uniq",
+)
+
+
+class DensityLotConcurrencyError(psycopg2.errors.SerializationFailure):
+    """A density lot was created by a concurrent transaction. Raised as a
+    serialization failure so that the request is retried, the lot is then
+    visible and found instead of created."""
+
+    pgcode = errorcodes.SERIALIZATION_FAILURE
 
 
 class StockProductionLot(models.Model):
     _inherit = "stock.production.lot"
 
-    biko_density_15c = fields.Float(string="Density 15c")
+    # the density identifies the lots created from purchases, the digits
+    # round it when stored so that equal densities always match
+    biko_density_15c = fields.Float(
+        string="Density 15c", digits=(6, DENSITY_15C_DIGITS)
+    )
+    biko_is_density_lot = fields.Boolean(
+        string="Density Lot",
+        readonly=True,
+        copy=False,
+        help="Lot created for its density at 15 C by the purchases.",
+    )
+
+    def init(self):
+        super(StockProductionLot, self).init()
+        tools.create_index(
+            self._cr,
+            "stock_production_lot_product_id_biko_density_15c_index",
+            self._table,
+            ["product_id", "biko_density_15c"],
+        )
+        # one density lot per product, so that concurrent purchases cannot
+        # create the same lot twice; the existing duplicates are unmarked by
+        # the 15.0.1.3.0 pre-migration
+        self._cr.execute(
+            """
+            create unique index if not exists %s on %s
+                (company_id, product_id, biko_density_15c)
+            where biko_is_density_lot
+            """
+            % (DENSITY_LOT_UNIQUE_INDEX, self._table)
+        )
+
+    @api.model
+    def _biko_normalize_density(self, density):
+        """Return ``density`` rounded as stored in the database: float_round()
+        alone may give a neighbour of that float (0.6001000000000001 for
+        0.6001), which would not match the stored lots."""
+        return float(
+            float_repr(
+                float_round(density or 0.0, precision_digits=DENSITY_15C_DIGITS),
+                DENSITY_15C_DIGITS,
+            )
+        )
+
+    @api.model
+    def _biko_get_density_lot_memo(self):
+        """Lot ids by ``(company_id, product_id, density_15c)``, kept until
+        the end of the current transaction (and dropped on rollback)."""
+        return self.env.cr.precommit.data.setdefault(
+            "biko_fuel_excise.density_lots", {}
+        )
+
+    @api.model
+    def _biko_find_density_lots(self, keys):
+        """Return the lots matching the ``(company_id, product_id,
+        density_15c)`` keys, as a dict by key. The keys that are not in the
+        memo yet are searched in a single query.
+        """
+        memo = self._biko_get_density_lot_memo()
+        keys = {
+            (company_id, product_id, self._biko_normalize_density(density))
+            for company_id, product_id, density in keys
+        }
+        # the lots created under a savepoint that was rolled back since are
+        # gone, they are searched again
+        memo_lots = self.browse({memo[key] for key in keys if memo.get(key)})
+        if memo_lots:
+            gone = set(memo_lots.ids) - set(memo_lots.exists().ids)
+            for key in keys:
+                if memo.get(key) in gone:
+                    del memo[key]
+        missing = [key for key in keys if key not in memo]
+        if missing:
+            lots = self.search(
+                [
+                    ("company_id", "in", list({key[0] for key in missing})),
+                    ("product_id", "in", list({key[1] for key in missing})),
+                    ("biko_density_15c", "in", list({key[2] for key in missing})),
+                ],
+                order="biko_is_density_lot desc, id",
+            )
+            for key in missing:
+                memo[key] = False
+            for lot in lots:
+                key = (
+                    lot.company_id.id,
+                    lot.product_id.id,
+                    self._biko_normalize_density(lot.biko_density_15c),
+                )
+                if memo.get(key) is False:
+                    memo[key] = lot.id
+        return {key: self.browse(memo[key]) for key in keys}
+
+    @api.model
+    def _biko_get_density_lot_names(self, keys):
+        """Return the names of the lots to create for the ``(company_id,
+        product_id, density_15c)`` keys, as a dict by key: the density,
+        numbered when another lot of the product already has that name."""
+        Lot = self.sudo()
+        names = {key: float_repr(key[2], DENSITY_15C_DIGITS) for key in keys}
+        lots = Lot.search(
+            [
+                ("company_id", "in", list({key[0] for key in keys})),
+                ("product_id", "in", list({key[1] for key in keys})),
+                ("name", "in", list(set(names.values()))),
+            ]
+        )
+        taken = {(lot.company_id.id, lot.product_id.id, lot.name) for lot in lots}
+        for key, name in names.items():
+            company_id, product_id, density = key
+            if (company_id, product_id, name) not in taken:
+                continue
+            used = set(
+                Lot.search(
+                    [
+                        ("company_id", "=", company_id),
+                        ("product_id", "=", product_id),
+                        ("name", "=like", "%s (%%)" % name),
+                    ]
+                ).mapped("name")
+            )
+            number = 2
+            while "%s (%s)" % (name, number) in used:
+                number += 1
+            names[key] = "%s (%s)" % (name, number)
+        return names
+
+    @api.model
+    def _biko_get_density_lots(self, keys):
+        """Return the lots matching the ``(company_id, product_id,
+        density_15c)`` keys, as a dict by key, and create the missing ones
+        all at once."""
+        lots = self._biko_find_density_lots(keys)
+        missing = [key for key, lot in lots.items() if not lot]
+        if not missing:
+            return lots
+        names = self._biko_get_density_lot_names(missing)
+        try:
+            with self.env.cr.savepoint(), mute_logger("odoo.sql_db"):
+                new_lots = self.create(
+                    [
+                        {
+                            "product_id": product_id,
+                            "biko_density_15c": density,
+                            "company_id": company_id,
+                            "name": names[company_id, product_id, density],
+                            "biko_is_density_lot": True,
+                        }
+                        for company_id, product_id, density in missing
+                    ]
+                )
+        except psycopg2.IntegrityError as e:
+            if (
+                e.pgcode != errorcodes.UNIQUE_VIOLATION
+                or e.diag.constraint_name not in DENSITY_LOT_CONSTRAINTS
+            ):
+                raise
+            # created by a concurrent transaction, which is not visible from
+            # this one
+            raise DensityLotConcurrencyError(
+                _("The lots for the densities at 15 C %s were created concurrently.")
+                % ", ".join(sorted({str(key[2]) for key in missing}))
+            ) from e
+        memo = self._biko_get_density_lot_memo()
+        for key, lot in zip(missing, new_lots):
+            memo[key] = lot.id
+            lots[key] = lot
+        return lots
+
+    @api.model
+    def _biko_get_density_lot(self, company, product, density):
+        """Return the lot of ``product`` with the given density at 15 C,
+        created if needed."""
+        key = (company.id, product.id, self._biko_normalize_density(density))
+        return self._biko_get_density_lots([key])[key]
@@ -0,0 +1,260 @@
+import logging
+
+from odoo import _, api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+QUANT_KEY_FIELDS = ("product_id", "location_id", "lot_id", "package_id", "owner_id")
+
+
+class StockQuant(models.Model):
+    _inherit = "stock.quant"
+
+    biko_quantity_15c = fields.Float(
+        string="Quantity at 15 C",
+        digits="Product Unit of Measure",
+        readonly=True,
+        copy=False,
+        default=0.0,
+    )
+
+    @api.model
+    def _update_quantity_15c(
+        self, product_id, location_id, quantity, lot_id=None, package_id=None, owner_id=None
+    ):
+        """Add ``quantity`` to the 15C quantity of the quant matching the
+        given key, created if there is none. The increment is done in SQL so
+        concurrent validations on the same quant do not overwrite each other."""
+        quants = self._gather(
+            product_id,
+            location_id,
+            lot_id=lot_id,
+            package_id=package_id,
+            owner_id=owner_id,
+            strict=True,
+        )
+        if not quants:
+            quant = self._biko_create_quant_15c(
+                product_id, location_id, lot_id, package_id, owner_id
+            )
+            if not quant:
+                return
+        else:
+            quant = quants[0]
+        self.env.cr.execute(
+            """
+            update stock_quant
+            set biko_quantity_15c = coalesce(biko_quantity_15c, 0) + %s
+            where id = %s
+            """,
+            (quantity, quant.id),
+        )
+        quant.invalidate_cache(["biko_quantity_15c"])
+
+    @api.model
+    def _biko_create_quant_15c(
+        self, product_id, location_id, lot_id=None, package_id=None, owner_id=None
+    ):
+        """Create an empty quant to hold a 15C quantity, or return an empty
+        recordset where quants cannot exist."""
+        if location_id.usage == "view":
+            _logger.warning(
+                "No quant can hold the 15C quantity of %s in the view location %s",
+                product_id.display_name,
+                location_id.display_name,
+            )
+            return self.browse()
+        return self.sudo().create(
+            {
+                "product_id": product_id.id,
+                "location_id": location_id.id,
+                "lot_id": lot_id.id if lot_id else False,
+                "package_id": package_id.id if package_id else False,
+                "owner_id": owner_id.id if owner_id else False,
+                "quantity": 0.0,
+            }
+        )
+
+    @api.model
+    def _merge_quants(self):
+        # keep the 15C quantity of the duplicates on the quant that survives
+        self.env.cr.execute(
+            """
+            update stock_quant as q
+            set biko_quantity_15c = dupes.biko_quantity_15c
+            from (
+                select
+                    min(id) as id,
+                    sum(coalesce(biko_quantity_15c, 0)) as biko_quantity_15c
+                from stock_quant
+                group by product_id, company_id, location_id, lot_id, package_id, owner_id
+                having count(id) > 1
+            ) as dupes
+            where dupes.id = q.id
+            """
+        )
+        return super(StockQuant, self)._merge_quants()
+
+    @api.model
+    def _biko_reconcile_quantity_15c(self, apply=True):
+        """Compare the 15C quantity of the quants with the balance of the done
+        move lines and, if ``apply``, rebuild it from the move lines.
+
+        :return: the list of drifts, one dict per quant key with the
+            ``expected`` and ``current`` 15C quantities
+        """
+        self.env["stock.move.line"].flush()
+        self.flush()
+        precision = self.env["decimal.precision"].precision_get(
+            "Product Unit of Measure"
+        )
+        expected_sql = """
+            select
+                product_id,
+                location_id,
+                lot_id,
+                package_id,
+                owner_id,
+                sum(qty) as qty
+            from (
+                select
+                    sml.product_id,
+                    sml.location_dest_id as location_id,
+                    sml.lot_id,
+                    sml.result_package_id as package_id,
+                    sml.owner_id,
+                    sml.biko_product_qty_15c_done as qty
+                from stock_move_line as sml
+                where sml.state = 'done'
+                union all
+                select
+                    sml.product_id,
+                    sml.location_id,
+                    sml.lot_id,
+                    sml.package_id,
+                    sml.owner_id,
+                    -sml.biko_product_qty_15c_done
+                from stock_move_line as sml
+                where sml.state = 'done'
+            ) as sides
+            join product_product as pp on (pp.id = sides.product_id)
+            join product_template as pt on (pt.id = pp.product_tmpl_id)
+            where pt.type = 'product'
+            group by product_id, location_id, lot_id, package_id, owner_id
+        """
+        key_join = " and ".join(
+            "expected.%s is not distinct from current.%s" % (fname, fname)
+            for fname in QUANT_KEY_FIELDS
+        )
+        # the 15C quantity is entered apart from the quantity, a key without
+        # stock keeps a residue that is written off rather than kept on an
+        # empty quant
+        self.env.cr.execute(
+            """
+            with
+                expected as (%s),
+                current as (
+                    select
+                        product_id,
+                        location_id,
+                        lot_id,
+                        package_id,
+                        owner_id,
+                        sum(quantity) as quantity,
+                        sum(coalesce(biko_quantity_15c, 0)) as qty
+                    from stock_quant
+                    group by product_id, location_id, lot_id, package_id, owner_id
+                ),
+                compared as (
+                    select
+                        current.product_id,
+                        current.location_id,
+                        current.lot_id,
+                        current.package_id,
+                        current.owner_id,
+                        case
+                            when round(current.quantity::numeric, %%(precision)s) = 0
+                            then 0
+                            else coalesce(expected.qty, 0)
+                        end as expected,
+                        current.qty as current
+                    from current
+                    left join expected on (%s)
+                )
+            select *
+            from compared
+            where round(expected::numeric, %%(precision)s)
+                != round(current::numeric, %%(precision)s)
+            """
+            % (expected_sql, key_join),
+            {"precision": precision},
+        )
+        drifts = self.env.cr.dictfetchall()
+        for drift in drifts:
+            _logger.warning(
+                "15C quantity drift on quant key %s: expected %s, found %s",
+                {fname: drift[fname] for fname in QUANT_KEY_FIELDS},
+                drift["expected"],
+                drift["current"],
+            )
+
+        if apply and drifts:
+            self.flush()
+            quant_join = " and ".join(
+                "expected.%s is not distinct from quant.%s" % (fname, fname)
+                for fname in QUANT_KEY_FIELDS
+            )
+            self.env.cr.execute(
+                """
+                with expected as (%s)
+                update stock_quant as q
+                set biko_quantity_15c = target.qty
+                from (
+                    select
+                        quant.id,
+                        case
+                            when row_number() over key_window = 1
+                                and round(
+                                    (sum(quant.quantity) over key_window)::numeric,
+                                    %%(precision)s
+                                ) != 0
+                            then coalesce(expected.qty, 0)
+                            else 0
+                        end as qty
+                    from stock_quant as quant
+                    left join expected on (%s)
+                    window key_window as (
+                        partition by quant.product_id, quant.location_id,
+                            quant.lot_id, quant.package_id, quant.owner_id
+                        order by quant.in_date, quant.id
+                        rows between unbounded preceding and unbounded following
+                    )
+                ) as target
+                where target.id = q.id
+                    and coalesce(q.biko_quantity_15c, 0) != target.qty
+                """
+                % (expected_sql, quant_join),
+                {"precision": precision},
+            )
+            self.invalidate_cache(["biko_quantity_15c"])
+        return drifts
+
+    @api.model
+    def action_biko_reconcile_quantity_15c(self):
+        drifts = self._biko_reconcile_quantity_15c()
+        if drifts:
+            message = _(
+                "%s quant balances at 15 C did not match the stock moves and have been rebuilt."
+            ) % len(drifts)
+        else:
+            message = _("All quant balances at 15 C match the stock moves.")
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": _("Quantity at 15 C"),
+                "message": message,
+                "type": "warning" if drifts else "success",
+                "sticky": bool(drifts),
+            },
+        }
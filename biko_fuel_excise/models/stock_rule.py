@@ -16,6 +16,8 @@ class StockRule(models.Model):
         fields += [
             "biko_density_fact",
             "biko_density_15c",
+            "biko_temperature",
+            "biko_temperature_measured",
             "biko_product_qty_15c",
             "biko_kg_qty_15c",
             "restrict_lot_id",
@@ -1 +1,3 @@
 from . import report_stock15c_moves
+from . import report_stock15c_moves_session
+from . import report_stock15c_moves_detail
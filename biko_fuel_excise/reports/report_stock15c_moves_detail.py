@@ -0,0 +1,180 @@
+from odoo import api, fields, models, tools
+from odoo.osv import expression
+from odoo.tools.lru import LRU
+
+# keys of the rows ending the pages served to the list view, by
+# (uid, companies, domain, offset of the next page)
+PAGE_KEYS = LRU(1024)
+
+
+class ReportStock15CMovesDetail(models.Model):
+    """The done move lines behind the 15C moves report, one row per internal
+    location they enter or leave, with their signed 15C quantity."""
+
+    _name = "stock.15c.moves.detail"
+    _auto = False
+    _description = "Report stock 15C moves detail"
+    _order = "date, move_line_id, direction"
+
+    date = fields.Datetime(readonly=True)
+    move_line_id = fields.Many2one("stock.move.line", "Move Line", readonly=True)
+    picking_id = fields.Many2one("stock.picking", "Transfer", readonly=True)
+    reference = fields.Char(readonly=True)
+    company_id = fields.Many2one("res.company", "Company", readonly=True)
+    product_id = fields.Many2one("product.product", "Product", readonly=True)
+    category_id = fields.Many2one("product.category", "Category", readonly=True)
+    location_id = fields.Many2one("stock.location", "Location", readonly=True)
+    counterpart_location_id = fields.Many2one(
+        "stock.location", "Counterpart Location", readonly=True
+    )
+    lot_id = fields.Many2one("stock.production.lot", "Lot", readonly=True)
+    direction = fields.Selection([("in", "In"), ("out", "Out")], readonly=True)
+    qty_15c = fields.Float("Quantity at 15 C", readonly=True)
+    density_15c = fields.Float("Density at 15 C", digits=(6, 4), readonly=True)
+    density_fact = fields.Float("Density", digits=(6, 4), readonly=True)
+
+    def init(self):
+        tools.drop_view_if_exists(self._cr, self._table)
+        side_sql = """
+            select
+                sml.id * 2 + %(offset)s as id,
+                sml.date,
+                sml.id as move_line_id,
+                sml.picking_id,
+                sml.reference,
+                location.company_id,
+                sml.product_id,
+                pt.categ_id as category_id,
+                location.id as location_id,
+                sml.%(counterpart)s as counterpart_location_id,
+                sml.lot_id,
+                '%(direction)s' as direction,
+                %(sign)ssml.biko_product_qty_15c_done as qty_15c,
+                coalesce(
+                    nullif(sml.biko_density_15c, 0),
+                    nullif(sm.biko_density_15c, 0),
+                    lot.biko_density_15c
+                ) as density_15c,
+                coalesce(
+                    nullif(sml.biko_density_fact, 0), sm.biko_density_fact
+                ) as density_fact
+            from stock_move_line as sml
+            join stock_location as location on (location.id = sml.%(location)s)
+            join product_product as pp on (pp.id = sml.product_id)
+            join product_template as pt on (pt.id = pp.product_tmpl_id)
+            left join stock_move as sm on (sm.id = sml.move_id)
+            left join stock_production_lot as lot on (lot.id = sml.lot_id)
+            where sml.state = 'done' and location.usage = 'internal'
+        """
+        self._cr.execute(
+            "create or replace view %s as (%s union all %s)"
+            % (
+                self._table,
+                side_sql
+                % {
+                    "offset": 0,
+                    "location": "location_dest_id",
+                    "counterpart": "location_id",
+                    "direction": "in",
+                    "sign": "",
+                },
+                side_sql
+                % {
+                    "offset": 1,
+                    "location": "location_id",
+                    "counterpart": "location_dest_id",
+                    "direction": "out",
+                    "sign": "-",
+                },
+            )
+        )
+
+    @api.model
+    def _get_keyset_domain(self, after):
+        """Domain of the rows sorted after the ``(date, move_line_id,
+        direction)`` key. It filters the real columns of the move lines, so
+        that each side of the view is read through the ``(date, id)`` index
+        instead of being sorted on the computed id."""
+        after_date, after_move_line_id, after_direction = after
+        return [
+            ("date", ">=", after_date),
+            "|",
+            ("date", ">", after_date),
+            "|",
+            ("move_line_id", ">", after_move_line_id),
+            "&",
+            ("move_line_id", "=", after_move_line_id),
+            ("direction", ">", after_direction),
+        ]
+
+    def _get_page_key(self):
+        self.ensure_one()
+        return [
+            fields.Datetime.to_string(self.date),
+            self.move_line_id.id,
+            self.direction,
+        ]
+
+    @api.model
+    def get_page(self, domain, fields_list=None, after=None, limit=80):
+        """Return the ``limit`` rows of ``domain`` that follow the
+        ``(date, move_line_id, direction)`` key ``after``, or the first ones
+        without it.
+
+        Pages are located through that ordering instead of an OFFSET, so
+        reading a page deep in the result costs the same as reading the first
+        one.
+
+        :return: dict with the read ``records`` and the ``next`` key to pass
+            as ``after`` for the following page (False on the last page)
+        """
+        if after:
+            domain = expression.AND([domain, self._get_keyset_domain(after)])
+        records = self.search(domain, limit=limit, order=self._order)
+        return {
+            "records": records.read(fields_list),
+            "next": len(records) == limit and records[-1]._get_page_key(),
+        }
+
+    @api.model
+    def web_search_read(
+        self, domain=None, fields=None, offset=0, limit=None, order=None
+    ):
+        """Serve the pages of the list view through the keyset of the page
+        before, when it was served by this worker: scrolling to the next
+        page then costs the same as reading the first one. Other pages fall
+        back to the OFFSET."""
+        domain = domain or []
+        if order and order != self._order:
+            return super(ReportStock15CMovesDetail, self).web_search_read(
+                domain, fields=fields, offset=offset, limit=limit, order=order
+            )
+        cache_key = (
+            self.env.uid,
+            tuple(self.env.companies.ids),
+            repr(domain),
+        )
+        after = offset and PAGE_KEYS.get(cache_key + (offset,))
+        if after:
+            records = self.search(
+                expression.AND([domain, self._get_keyset_domain(after)]),
+                limit=limit,
+                order=self._order,
+            )
+        else:
+            records = self.search(
+                domain, offset=offset, limit=limit, order=self._order
+            )
+        if not records:
+            return {"length": 0, "records": []}
+        if limit:
+            next_offset = offset + len(records)
+            PAGE_KEYS[cache_key + (next_offset,)] = records[-1]._get_page_key()
+        values = records.read(fields)
+        if limit and (
+            len(records) == limit or self.env.context.get("force_search_count")
+        ):
+            length = self.search_count(domain)
+        else:
+            length = len(records) + offset
+        return {"length": length, "records": values}
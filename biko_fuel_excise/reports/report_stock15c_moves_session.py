@@ -0,0 +1,242 @@
+import json
+import logging
+import threading
+from datetime import timedelta
+
+from odoo import _, api, fields, models
+from odoo.tools import config
+
+from .report_stock15c_moves import set_unlogged
+
+_logger = logging.getLogger(__name__)
+
+
+class ReportStock15CMovesSession(models.Model):
+    """A filled batch of ``stock.15c.moves.report`` rows, reused by the
+    wizard as long as the report parameters and the move lines behind it
+    are unchanged. Long reports are filled in the background by a cron job,
+    the session then tracks the progress and notifies the users who asked
+    for it."""
+
+    _name = "stock.15c.moves.session"
+    _description = "Report stock 15C moves session"
+    _order = "id desc"
+
+    uid = fields.Char(required=True, readonly=True, index=True)
+    key = fields.Char(required=True, readonly=True, index=True)
+    company_id = fields.Many2one("res.company", "Company", readonly=True)
+    start_date = fields.Date(readonly=True)
+    end_date = fields.Date(readonly=True)
+    last_used_date = fields.Datetime(
+        readonly=True, default=lambda self: fields.Datetime.now()
+    )
+    user_id = fields.Many2one("res.users", "Requested by", readonly=True)
+    requester_ids = fields.Many2many(
+        "res.users",
+        "stock_15c_moves_session_res_users_rel",
+        "session_id",
+        "user_id",
+        string="Notified Users",
+        readonly=True,
+    )
+    wizard_values = fields.Text(readonly=True)
+    state = fields.Selection(
+        [
+            ("pending", "Pending"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        readonly=True,
+    )
+    progress = fields.Float(readonly=True)
+    error = fields.Text(readonly=True)
+
+    def init(self):
+        # unlogged like the report rows, so that both are emptied together
+        # after a crash and no session points to rows that are gone; the
+        # requesters first, a logged table cannot reference an unlogged one
+        set_unlogged(self._cr, "stock_15c_moves_session_res_users_rel")
+        set_unlogged(self._cr, self._table)
+
+    @api.model
+    def _get_ttl(self):
+        return timedelta(
+            hours=int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param("biko_fuel_excise.report_session_ttl_hours", 24)
+            )
+        )
+
+    @api.model
+    def _get_run_timeout(self):
+        """Return how long a cron worker may run before being killed, or None
+        without limit."""
+        limit = config.get("limit_time_real_cron", -1)
+        if limit is None or limit < 0:
+            limit = config.get("limit_time_real")
+        return timedelta(seconds=limit) if limit and limit > 0 else None
+
+    @api.model
+    def _find(self, key):
+        """Return the live session filled for ``key`` and mark it as used.
+
+        A session running for longer than the cron timeout belongs to a
+        worker that died, it is marked as failed so that a new one is made."""
+        session = self.search(
+            [
+                ("key", "=", key),
+                ("state", "!=", "failed"),
+                ("last_used_date", ">=", fields.Datetime.now() - self._get_ttl()),
+            ],
+            limit=1,
+        )
+        timeout = self._get_run_timeout()
+        if (
+            session.state == "running"
+            and timeout
+            and session.write_date < fields.Datetime.now() - timeout
+        ):
+            session.write(
+                {
+                    "state": "failed",
+                    "error": _("The report preparation was interrupted."),
+                }
+            )
+            return self.browse()
+        if session.state == "done":
+            session.last_used_date = fields.Datetime.now()
+        return session
+
+    def _add_requester(self, user):
+        """Notify ``user`` as well when the report is ready."""
+        self.sudo().requester_ids = [(4, user.id)]
+
+    def name_get(self):
+        return [
+            (
+                session.id,
+                "%s: %s - %s"
+                % (session.company_id.name, session.start_date, session.end_date),
+            )
+            for session in self
+        ]
+
+    def _schedule(self):
+        self.env.ref("biko_fuel_excise.ir_cron_stock_15c_moves_session_run")._trigger()
+
+    def _get_pending_notification_action(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": _("Stock 15C Moves"),
+                "message": _(
+                    "The report is being prepared (%s%%), you will be notified when it is ready."
+                )
+                % int(self.progress),
+                "type": "info",
+                "next": {"type": "ir.actions.act_window_close"},
+            },
+        }
+
+    def _set_progress(self, done, total):
+        # written from a separate cursor, the filling transaction is still
+        # running and its rows are not committed yet; only possible once the
+        # "running" state is committed, the row is locked until then
+        with self.env.registry.cursor() as cr:
+            cr.execute(
+                "update stock_15c_moves_session set progress = %s where id = %s",
+                (100.0 * done / total, self.id),
+            )
+
+    def _run(self):
+        self.ensure_one()
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        self.write({"state": "running", "progress": 0.0})
+        if auto_commit:
+            self.env.cr.commit()
+
+        error = False
+        try:
+            with self.env.cr.savepoint():
+                values = json.loads(self.wizard_values)
+                wizard = self.env["stock.15c.moves.wizard"].create(
+                    dict(
+                        values,
+                        company_ids=[(6, 0, values["company_ids"])],
+                        warehouse_ids=[(6, 0, values["warehouse_ids"])],
+                    )
+                )
+                wizard.fill_moves_data(
+                    self.uid,
+                    progress_callback=self._set_progress if auto_commit else None,
+                )
+        except Exception as e:
+            _logger.exception("Stock 15C moves report %s failed", self.uid)
+            error = str(e)
+        # the progress was committed by other transactions meanwhile, start
+        # a new one before writing on the session again
+        if auto_commit:
+            self.env.cr.commit()
+
+        if error:
+            self.write({"state": "failed", "error": error})
+        else:
+            self.write({"state": "done", "progress": 100.0})
+        self._notify_requesters()
+        if auto_commit:
+            self.env.cr.commit()
+
+    def _notify_requesters(self):
+        """Send the outcome to the requesters, the notification of a finished
+        report opens it, see stock_15c_report_notification.js."""
+        self.ensure_one()
+        for user in self.requester_ids | self.user_id:
+            self.env["bus.bus"]._sendone(
+                user.partner_id,
+                "biko_stock_15c_report",
+                {
+                    "session_id": self.id,
+                    "title": _("Stock 15C report is ready")
+                    if self.state == "done"
+                    else _("Stock 15C report failed"),
+                    "message": self.display_name,
+                    "type": "success" if self.state == "done" else "danger",
+                    "open_label": _("Open report") if self.state == "done" else False,
+                },
+            )
+
+    def action_open_report(self):
+        self.ensure_one()
+        if self.state != "done":
+            return self._get_pending_notification_action()
+        self.sudo().last_used_date = fields.Datetime.now()
+        return self.env["stock.15c.moves.wizard"]._get_report_action(self.uid)
+
+    @api.model
+    def _cron_run_pending(self):
+        for session in self.search([("state", "=", "pending")], order="id"):
+            session._run()
+
+    @api.model
+    def _cron_purge_sessions(self):
+        limit_date = fields.Datetime.now() - self._get_ttl()
+        self.search([("last_used_date", "<", limit_date)]).unlink()
+        self.flush()
+        self.env.cr.execute(
+            """
+            delete from stock_15c_moves_report as report
+            where report.create_date < %s
+                and not exists (
+                    select 1
+                    from stock_15c_moves_session as session
+                    where session.uid = report.uid
+                )
+            """,
+            (limit_date,),
+        )
+        self.env["stock.15c.moves.report"].invalidate_cache()
@@ -0,0 +1,49 @@
+/** @odoo-module **/
+
+import { registry } from "@web/core/registry";
+
+/**
+ * Shows the notifications of the background 15C reports, the one of a
+ * finished report has a button opening it.
+ */
+export const stock15cReportNotificationService = {
+    dependencies: ["action", "notification", "orm"],
+
+    start(env, { action, notification, orm }) {
+        const legacyEnv = owl.Component.env;
+        legacyEnv.services.bus_service.onNotification(this, (notifications) => {
+            for (const { payload, type } of notifications) {
+                if (type !== "biko_stock_15c_report") {
+                    continue;
+                }
+                let closeNotification = () => {};
+                const buttons = [];
+                if (payload.open_label) {
+                    buttons.push({
+                        name: payload.open_label,
+                        primary: true,
+                        onClick: async () => {
+                            closeNotification();
+                            const reportAction = await orm.call(
+                                "stock.15c.moves.session",
+                                "action_open_report",
+                                [[payload.session_id]]
+                            );
+                            action.doAction(reportAction);
+                        },
+                    });
+                }
+                closeNotification = notification.add(payload.message, {
+                    title: payload.title,
+                    type: payload.type,
+                    sticky: Boolean(payload.open_label),
+                    buttons,
+                });
+            }
+        });
+    },
+};
+
+registry
+    .category("services")
+    .add("biko_stock_15c_report_notification", stock15cReportNotificationService);
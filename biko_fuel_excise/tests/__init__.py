@@ -0,0 +1,6 @@
+from . import test_density_lots
+from . import test_purchase_picking_updates
+from . import test_sale_stock_rules
+from . import test_stock_15c_moves_export
+from . import test_stock_move_batch_reservation
+from . import test_volume_correction
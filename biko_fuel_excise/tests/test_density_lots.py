@@ -0,0 +1,83 @@
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged("post_install", "-at_install")
+class TestDensityLots(TransactionCase):
+    def setUp(self):
+        super(TestDensityLots, self).setUp()
+        self.Lot = self.env["stock.production.lot"]
+        self.partner = self.env["res.partner"].create({"name": "Supplier"})
+        self.product = self.env["product.product"].create(
+            {"name": "Diesel", "type": "product", "tracking": "lot"}
+        )
+
+    def _confirm_purchase(self, density_15c):
+        order = self.env["purchase.order"].create(
+            {
+                "partner_id": self.partner.id,
+                "order_line": [
+                    (
+                        0,
+                        0,
+                        {
+                            "product_id": self.product.id,
+                            "product_qty": 1000.0,
+                            "price_unit": 1.0,
+                            "biko_density_15c": density_15c,
+                        },
+                    )
+                ],
+            }
+        )
+        order.button_confirm()
+        return order
+
+    def _forget(self):
+        """Start over as a new transaction would: nothing in the caches."""
+        self.env["base"].flush()
+        self.env.cache.invalidate()
+        self.env.cr.precommit.data.pop("biko_fuel_excise.density_lots", None)
+
+    def test_normalize_density(self):
+        for density in (0.6001, 0.7123, 0.8345, 1.0999):
+            self.assertEqual(self.Lot._biko_normalize_density(density), density)
+        self.assertEqual(self.Lot._biko_normalize_density(0.83456), 0.8346)
+
+    def test_density_lot_reused(self):
+        # float_round(0.6001, 4) is 0.6001000000000001
+        first = self._confirm_purchase(0.6001)
+        self._forget()
+        second = self._confirm_purchase(0.6001)
+        lot = first.order_line.biko_lot_id
+        self.assertTrue(lot)
+        self.assertEqual(second.order_line.biko_lot_id, lot)
+        self.assertEqual(lot.name, "0.6001")
+        self.assertEqual(
+            self.Lot.search_count([("product_id", "=", self.product.id)]), 1
+        )
+
+    def test_density_lot_name_taken(self):
+        manual_lot = self.Lot.create(
+            {
+                "name": "0.7123",
+                "product_id": self.product.id,
+                "company_id": self.env.company.id,
+            }
+        )
+        order = self._confirm_purchase(0.7123)
+        lot = order.order_line.biko_lot_id
+        self.assertNotEqual(lot, manual_lot)
+        self.assertEqual(lot.name, "0.7123 (2)")
+        self.assertTrue(lot.biko_is_density_lot)
+
+    def test_density_lot_rolled_back(self):
+        company = self.env.company
+        try:
+            with self.env.cr.savepoint():
+                lot = self.Lot._biko_get_density_lot(company, self.product, 0.8345)
+                raise ValueError()
+        except ValueError:
+            pass
+        new_lot = self.Lot._biko_get_density_lot(company, self.product, 0.8345)
+        self.assertNotEqual(new_lot.id, lot.id)
+        self.assertTrue(new_lot.exists())
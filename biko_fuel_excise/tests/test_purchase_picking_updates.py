@@ -0,0 +1,54 @@
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged("post_install", "-at_install")
+class TestPurchasePickingUpdates(TransactionCase):
+    def setUp(self):
+        super(TestPurchasePickingUpdates, self).setUp()
+        self.product = self.env["product.product"].create(
+            {"name": "Diesel", "type": "product", "tracking": "lot"}
+        )
+        self.order = self.env["purchase.order"].create(
+            {
+                "partner_id": self.env["res.partner"].create({"name": "Supplier"}).id,
+                "order_line": [
+                    (
+                        0,
+                        0,
+                        {
+                            "product_id": self.product.id,
+                            "product_qty": 1000.0,
+                            "price_unit": 1.0,
+                            "biko_density_15c": 0.84,
+                            "biko_product_qty_15c": 990.0,
+                        },
+                    )
+                ],
+            }
+        )
+        self.order.button_confirm()
+        self.line = self.order.order_line
+
+    def _get_moves_qty_15c(self):
+        return sum(
+            self.line.move_ids.filtered(lambda m: m.state != "cancel").mapped(
+                "biko_product_qty_15c"
+            )
+        )
+
+    def test_deferred_picking_updates(self):
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 990.0)
+        self.line.with_context(biko_defer_picking_updates=True).write(
+            {"biko_product_qty_15c": 995.0}
+        )
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 990.0)
+        self.env["purchase.order.line"]._biko_flush_picking_updates()
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 995.0)
+
+    def test_picking_updates_on_write(self):
+        self.order.write(
+            {"order_line": [(1, self.line.id, {"biko_product_qty_15c": 985.0})]}
+        )
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 985.0)
+        self.line.write({"biko_product_qty_15c": 980.0})
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 980.0)
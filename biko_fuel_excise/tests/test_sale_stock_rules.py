@@ -0,0 +1,52 @@
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged("post_install", "-at_install")
+class TestSaleStockRules(TransactionCase):
+    def setUp(self):
+        super(TestSaleStockRules, self).setUp()
+        self.product = self.env["product.product"].create(
+            {"name": "Diesel", "type": "product"}
+        )
+        self.order = self.env["sale.order"].create(
+            {
+                "partner_id": self.env["res.partner"].create({"name": "Customer"}).id,
+                "order_line": [
+                    (
+                        0,
+                        0,
+                        {
+                            "product_id": self.product.id,
+                            "product_uom_qty": 1000.0,
+                            "biko_product_qty_15c": 990.0,
+                        },
+                    )
+                ],
+            }
+        )
+        self.order.action_confirm()
+        self.line = self.order.order_line
+
+    def _get_moves_qty_15c(self):
+        return sum(
+            self.line.move_ids.filtered(lambda m: m.state != "cancel").mapped(
+                "biko_product_qty_15c"
+            )
+        )
+
+    def test_deferred_stock_rules(self):
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 990.0)
+        self.line.with_context(biko_defer_stock_rules=True).write(
+            {"biko_product_qty_15c": 995.0}
+        )
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 990.0)
+        self.env["sale.order.line"]._biko_flush_stock_rules()
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 995.0)
+
+    def test_stock_rules_on_write(self):
+        self.order.write(
+            {"order_line": [(1, self.line.id, {"biko_product_qty_15c": 985.0})]}
+        )
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 985.0)
+        self.line.write({"biko_product_qty_15c": 980.0})
+        self.assertAlmostEqual(self._get_moves_qty_15c(), 980.0)
@@ -0,0 +1,51 @@
+import hashlib
+
+from odoo.tests import HttpCase, tagged
+
+
+@tagged("post_install", "-at_install")
+class TestStock15CMovesExport(HttpCase):
+    def setUp(self):
+        super(TestStock15CMovesExport, self).setUp()
+        self.wizard = (
+            self.env["stock.15c.moves.wizard"]
+            .with_user(self.env.ref("base.user_admin"))
+            .create(
+                {
+                    "start_date": "2024-01-01",
+                    "end_date": "2024-01-31",
+                    "export_format": "csv",
+                }
+            )
+        )
+        self.columns = [("product", "Product"), ("qty", "Quantity")]
+        self.rows = [
+            {"product": "Diesel", "qty": 1.5},
+            {"product": "Бензин, А-95", "qty": -2.0},
+        ]
+        self.expected = (
+            "Product,Quantity\r\nDiesel,1.5\r\n\"Бензин, А-95\",-2.0\r\n"
+        ).encode("utf-8")
+
+    def _download(self, action):
+        self.authenticate("admin", "admin")
+        response = self.url_open(action["url"])
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_export_file_storage(self):
+        action = self.wizard._export("export", self.columns, iter(self.rows))
+        attachment = self.env["ir.attachment"].search(
+            [("res_model", "=", self.wizard._name), ("res_id", "=", self.wizard.id)]
+        )
+        self.assertEqual(attachment.name, "export.csv")
+        self.assertEqual(attachment.mimetype, "text/csv")
+        self.assertEqual(attachment.file_size, len(self.expected))
+        self.assertEqual(attachment.checksum, hashlib.sha1(self.expected).hexdigest())
+        self.assertEqual(attachment.raw, self.expected)
+        self.assertEqual(self._download(action), self.expected)
+
+    def test_export_db_storage(self):
+        self.env["ir.config_parameter"].sudo().set_param("ir_attachment.location", "db")
+        action = self.wizard._export("export", self.columns, iter(self.rows))
+        self.assertEqual(self._download(action), self.expected)
@@ -0,0 +1,137 @@
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged("post_install", "-at_install")
+class TestStockMoveBatchReservation(TransactionCase):
+    def setUp(self):
+        super(TestStockMoveBatchReservation, self).setUp()
+        Location = self.env["stock.location"]
+        Quant = self.env["stock.quant"]
+        self.stock = self.env.ref("stock.stock_location_stock")
+        self.customers = self.env.ref("stock.stock_location_customers")
+        self.shelf = Location.create({"name": "Shelf", "location_id": self.stock.id})
+        self.tank = Location.create({"name": "Tank", "location_id": self.stock.id})
+        self.tank_bin = Location.create({"name": "Bin", "location_id": self.tank.id})
+        self.product = self.env["product.product"].create(
+            {"name": "Diesel", "type": "product", "tracking": "lot"}
+        )
+        self.env["stock.putaway.rule"].create(
+            {
+                "product_id": self.product.id,
+                "location_in_id": self.tank.id,
+                "location_out_id": self.tank_bin.id,
+            }
+        )
+        Lot = self.env["stock.production.lot"]
+        company = self.env.company
+        self.lot_1 = Lot.create(
+            {"name": "L1", "product_id": self.product.id, "company_id": company.id}
+        )
+        self.lot_2 = Lot.create(
+            {"name": "L2", "product_id": self.product.id, "company_id": company.id}
+        )
+        for location, qty, lot in (
+            (self.stock, 30, self.lot_1),
+            (self.shelf, 20, self.lot_1),
+            (self.stock, 10, self.lot_2),
+            (self.stock, 5, None),
+        ):
+            Quant._update_available_quantity(self.product, location, qty, lot_id=lot)
+
+    def _create_moves(self, quantities):
+        moves = self.env["stock.move"].create(
+            [
+                {
+                    "name": self.product.name,
+                    "product_id": self.product.id,
+                    "product_uom": self.product.uom_id.id,
+                    "product_uom_qty": qty,
+                    "location_id": self.stock.id,
+                    "location_dest_id": location.id,
+                    "restrict_lot_id": lot.id,
+                }
+                for lot, qty, location in quantities
+            ]
+        )
+        moves._action_confirm(merge=False)
+        return moves
+
+    def _set_batch_reservation(self, enabled):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "biko_fuel_excise.batch_reservation", int(enabled)
+        )
+
+    def _get_reservation(self, moves):
+        quants = self.env["stock.quant"].search(
+            [("product_id", "=", self.product.id)]
+        )
+        return (
+            [
+                (
+                    move.state,
+                    sorted(
+                        (
+                            ml.location_id.id,
+                            ml.location_dest_id.id,
+                            ml.lot_id.id,
+                            ml.product_uom_qty,
+                        )
+                        for ml in move.move_line_ids
+                    ),
+                )
+                for move in moves
+            ],
+            sorted(
+                (quant.location_id.id, quant.lot_id.id, quant.reserved_quantity)
+                for quant in quants
+            ),
+        )
+
+    def test_batch_reservation_matches_action_assign(self):
+        moves = self._create_moves(
+            [
+                (self.lot_1, 25, self.customers),
+                (self.lot_1, 15, self.tank),
+                (self.lot_2, 8, self.tank),
+                (self.lot_1, 20, self.customers),
+                (self.lot_2, 8, self.customers),
+            ]
+        )
+        self._set_batch_reservation(False)
+        moves._action_assign()
+        expected = self._get_reservation(moves)
+        self.assertIn(
+            self.tank_bin,
+            moves.move_line_ids.location_dest_id,
+            "the putaway rule should apply to the reserved lines",
+        )
+
+        moves._do_unreserve()
+        self._set_batch_reservation(True)
+        self.assertEqual(moves._biko_get_batch_reservation_moves(), moves)
+        moves._action_assign()
+        self.assertEqual(self._get_reservation(moves), expected)
+
+    def test_batch_reservation_nets_negative_quants(self):
+        negative = self.env["stock.location"].create(
+            {"name": "Negative", "location_id": self.stock.id}
+        )
+        self.env["stock.quant"]._update_available_quantity(
+            self.product, negative, -15, lot_id=self.lot_1
+        )
+        moves = self._create_moves(
+            [
+                (self.lot_1, 25, self.customers),
+                (self.lot_1, 20, self.customers),
+            ]
+        )
+        self._set_batch_reservation(False)
+        moves._action_assign()
+        expected = self._get_reservation(moves)
+        self.assertEqual(moves.mapped("state"), ["assigned", "partially_available"])
+        self.assertEqual(sum(moves.move_line_ids.mapped("product_uom_qty")), 40)
+
+        moves._do_unreserve()
+        self._set_batch_reservation(True)
+        moves._action_assign()
+        self.assertEqual(self._get_reservation(moves), expected)
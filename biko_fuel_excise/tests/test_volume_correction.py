@@ -0,0 +1,79 @@
+import math
+
+from odoo.tests import BaseCase
+
+from ..tools import volume_correction
+
+
+class TestVolumeCorrection(BaseCase):
+    def test_vcf_reference_values(self):
+        # ASTM D1250 table 54B, density at 15 C (kg/l), temperature (C)
+        for density_15c, temperature, expected in (
+            (0.740, 30.0, 0.9815),
+            (0.800, -10.0, 1.0231),
+            (0.840, 25.0, 0.9915),
+            (0.840, 5.0, 1.0084),
+            (0.840, 15.0, 1.0),
+        ):
+            self.assertAlmostEqual(
+                float(volume_correction.vcf(density_15c, temperature)),
+                expected,
+                places=4,
+            )
+
+    def test_vcf_table_matches_formula(self):
+        densities = [0.7234, 0.7891, 0.8567, 0.9123]
+        temperatures = [-23.4, 2.7, 17.1, 41.9]
+        factors = volume_correction.vcf(densities, temperatures)
+        formula = volume_correction.vcf_formula(densities, temperatures)
+        for factor, expected in zip(factors, formula):
+            self.assertAlmostEqual(float(factor), float(expected), places=4)
+
+    def test_vcf_out_of_grid(self):
+        vcf = volume_correction.vcf
+        # clamped to the edges of the shipped grid
+        for outside, edge in (
+            ((0.840, 80.0), (0.840, 60.0)),
+            ((0.840, -60.0), (0.840, -40.0)),
+            ((0.500, 25.0), (0.610, 25.0)),
+            ((1.300, 25.0), (1.164, 25.0)),
+        ):
+            self.assertAlmostEqual(float(vcf(*outside)), float(vcf(*edge)), places=6)
+
+    def test_vcf_nan_temperature(self):
+        factors = volume_correction.vcf([0.840, 0.840], [float("nan"), 25.0])
+        self.assertTrue(math.isnan(factors[0]))
+        self.assertAlmostEqual(float(factors[1]), 0.9915, places=4)
+
+    def test_density_15c_from_observed(self):
+        density_15c = 0.8345
+        density = density_15c * float(volume_correction.vcf(density_15c, 28.0))
+        self.assertAlmostEqual(
+            float(volume_correction.density_15c_from_observed(density, 28.0)),
+            density_15c,
+            places=4,
+        )
+
+    def test_convert(self):
+        conversion = volume_correction.convert(
+            [1000.0, 1000.0, 1000.0, 1000.0],
+            [0.835, 0.835, 0.835, 0.835],
+            density_15c=[0.840, 0.0, 0.840, float("nan")],
+            temperature=[25.0, 15.0, float("nan"), float("nan")],
+        )
+        for mass in conversion.mass:
+            self.assertAlmostEqual(float(mass), 835.0)
+        # the known density at 15 C is kept, the missing one derived
+        self.assertEqual(list(conversion.density_15c), [0.840, 0.835, 0.840, 0.0])
+        self.assertAlmostEqual(float(conversion.vcf[0]), 0.9915, places=4)
+        self.assertAlmostEqual(float(conversion.vcf[1]), 1.0, places=6)
+        # without temperature, no factor and nothing derived
+        self.assertTrue(math.isnan(conversion.vcf[2]))
+        self.assertTrue(math.isnan(conversion.vcf[3]))
+        self.assertAlmostEqual(float(conversion.volume_15c[2]), 835.0 / 0.840)
+        self.assertEqual(float(conversion.volume_15c[3]), 0.0)
+
+    def test_mass_to_volume_15c_unknown_density(self):
+        volumes = volume_correction.mass_to_volume_15c([840.0, 840.0], [0.840, 0.0])
+        self.assertAlmostEqual(float(volumes[0]), 1000.0)
+        self.assertEqual(float(volumes[1]), 0.0)
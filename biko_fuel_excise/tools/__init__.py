@@ -0,0 +1 @@
+from . import volume_correction
@@ -0,0 +1,213 @@
+"""Conversion of observed fuel quantities to quantities at 15 C.
+
+All functions work on arrays (or scalars) so a whole recordset is converted
+in one call. Densities are in kg/l, as in the fields of the module, and
+temperatures in degrees Celsius.
+
+The volume correction factors follow the ASTM D1250 / API MPMS 11.1
+generalized tables: 54A for crude oils and 54B for refined products, where
+
+    alpha = K0 / rho15 ** 2 + K1 / rho15 + A
+    VCF = exp(-alpha * dt * (1 + 0.8 * alpha * dt)),  dt = t - 15
+
+with ``rho15`` in kg/m3 and the constants depending on the density range.
+
+The factors of the tables shipped in ``data/vcf_table_<table>.csv`` (a
+density x temperature grid built by :func:`build_table`) are read once per
+process and looked up by bilinear interpolation, other tables fall back to
+the formula.
+"""
+import functools
+import os
+from collections import namedtuple
+
+import numpy as np
+
+BASE_TEMPERATURE = 15.0
+
+# density ranges of each table: (lower bound in kg/m3, K0, K1, A)
+TABLES = {
+    "54A": ((0.0, 613.9723, 0.0, 0.0),),
+    "54B": (
+        # gasolines
+        (0.0, 346.4228, 0.4388, 0.0),
+        # transition zone
+        (770.352, 2680.3206, 0.0, -0.00336312),
+        # jet fuels, kerosene
+        (787.5195, 594.5418, 0.0, 0.0),
+        # fuel oils, diesel
+        (838.3127, 186.9696, 0.4862, 0.0),
+    ),
+}
+DEFAULT_TABLE = "54B"
+
+TABLE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "vcf_table_%s.csv"
+)
+
+Conversion = namedtuple("Conversion", ["mass", "volume_15c", "density_15c", "vcf"])
+VcfTable = namedtuple(
+    "VcfTable",
+    ["density_start", "density_step", "temperature_start", "temperature_step", "factors"],
+)
+
+
+def _array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def thermal_expansion(density_15c, table=DEFAULT_TABLE):
+    """Return the thermal expansion coefficient at 15 C (alpha, per degree)
+    of products of density ``density_15c`` (kg/l)."""
+    rho = _array(density_15c) * 1000.0
+    ranges = np.array(TABLES[table])
+    index = np.searchsorted(ranges[:, 0], rho, side="right") - 1
+    k0, k1, a = ranges[index, 1], ranges[index, 2], ranges[index, 3]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return k0 / rho ** 2 + k1 / rho + a
+
+
+def vcf_formula(density_15c, temperature, table=DEFAULT_TABLE):
+    """Return the volume correction factors from ``temperature`` to 15 C,
+    computed from the table formula."""
+    alpha = thermal_expansion(density_15c, table)
+    delta = _array(temperature) - BASE_TEMPERATURE
+    return np.exp(-alpha * delta * (1.0 + 0.8 * alpha * delta))
+
+
+def build_table(table, densities, temperatures):
+    """Return the grid of the factors of ``table`` for the evenly spaced
+    ``densities`` (rows) and ``temperatures`` (columns)."""
+    density_grid, temperature_grid = np.meshgrid(
+        _array(densities), _array(temperatures), indexing="ij"
+    )
+    return vcf_formula(density_grid, temperature_grid, table)
+
+
+@functools.lru_cache(maxsize=None)
+def load_table(table):
+    """Return the :class:`VcfTable` shipped for ``table``, or None."""
+    path = TABLE_PATH % table.lower()
+    if not os.path.isfile(path):
+        return None
+    with open(path) as table_file:
+        temperatures = _array(table_file.readline().strip().split(",")[1:])
+        grid = np.loadtxt(table_file, delimiter=",", ndmin=2)
+    densities = grid[:, 0]
+    return VcfTable(
+        density_start=densities[0],
+        density_step=(densities[-1] - densities[0]) / (len(densities) - 1),
+        temperature_start=temperatures[0],
+        temperature_step=(temperatures[-1] - temperatures[0]) / (len(temperatures) - 1),
+        factors=grid[:, 1:].astype(np.float32),
+    )
+
+
+def _grid_position(values, start, step, size):
+    """Return the lower grid index of ``values`` and their offset from it,
+    values outside of the grid are clamped to its edges. NaN values get a
+    NaN offset, so that their factor is NaN."""
+    position = np.clip((values - start) / step, 0, size - 1)
+    index = np.minimum(np.floor(np.nan_to_num(position)).astype(np.intp), size - 2)
+    return index, position - index
+
+
+def interpolate(vcf_table, density_15c, temperature):
+    """Return the factors of ``vcf_table`` interpolated at the given points,
+    in constant time per point."""
+    factors = vcf_table.factors
+    i, di = _grid_position(
+        _array(density_15c),
+        vcf_table.density_start,
+        vcf_table.density_step,
+        factors.shape[0],
+    )
+    j, dj = _grid_position(
+        _array(temperature),
+        vcf_table.temperature_start,
+        vcf_table.temperature_step,
+        factors.shape[1],
+    )
+    return (
+        factors[i, j] * (1 - di) * (1 - dj)
+        + factors[i + 1, j] * di * (1 - dj)
+        + factors[i, j + 1] * (1 - di) * dj
+        + factors[i + 1, j + 1] * di * dj
+    )
+
+
+def vcf(density_15c, temperature, table=DEFAULT_TABLE):
+    """Return the volume correction factors from ``temperature`` to 15 C."""
+    vcf_table = load_table(table)
+    if vcf_table is None:
+        return vcf_formula(density_15c, temperature, table)
+    return interpolate(vcf_table, density_15c, temperature)
+
+
+def density_15c_from_observed(density, temperature, table=DEFAULT_TABLE, iterations=6):
+    """Return the densities at 15 C of products whose density ``density`` was
+    observed at ``temperature``, by fixed-point iteration on
+    ``rho15 = rho_t / VCF(rho15, t)``."""
+    density = _array(density)
+    density_15c = density
+    for _i in range(iterations):
+        density_15c = density / vcf(density_15c, temperature, table)
+    return density_15c
+
+
+def mass_to_volume_15c(mass, density_15c):
+    """Return ``mass / density_15c``, 0 where the density is unknown."""
+    mass = _array(mass)
+    density_15c = _array(density_15c)
+    return np.divide(
+        mass,
+        density_15c,
+        out=np.zeros(np.broadcast(mass, density_15c).shape),
+        where=density_15c > 0,
+    )
+
+
+def convert(volume, density, density_15c=None, temperature=None, table=DEFAULT_TABLE):
+    """Convert observed volumes to mass and volumes at 15 C.
+
+    :param volume: observed volumes (l)
+    :param density: observed densities (kg/l)
+    :param density_15c: known densities at 15 C (kg/l), 0 or NaN if unknown
+    :param temperature: observation temperatures (C), NaN if unknown. The
+        missing densities at 15 C are derived from the observed ones at
+        these temperatures.
+    :return: a :class:`Conversion` of arrays: ``mass`` (kg), ``volume_15c``
+        (l), ``density_15c`` (kg/l, 0 if unknown) and ``vcf`` (NaN if the
+        temperature is unknown)
+    """
+    volume = _array(volume)
+    density = _array(density)
+    shape = np.broadcast(volume, density).shape
+    density_15c = np.broadcast_to(
+        _array(np.nan if density_15c is None else density_15c), shape
+    ).copy()
+    temperature = np.broadcast_to(
+        _array(np.nan if temperature is None else temperature), shape
+    )
+    density_15c[np.isnan(density_15c)] = 0.0
+
+    mass = volume * density
+    known_temperature = ~np.isnan(temperature)
+    to_derive = known_temperature & (density_15c <= 0) & (density > 0)
+    if to_derive.any():
+        density_15c[to_derive] = density_15c_from_observed(
+            density[to_derive], temperature[to_derive], table
+        )
+
+    factors = np.full(shape, np.nan)
+    to_correct = known_temperature & (density_15c > 0)
+    if to_correct.any():
+        factors[to_correct] = vcf(
+            density_15c[to_correct], temperature[to_correct], table
+        )
+    return Conversion(
+        mass=mass,
+        volume_15c=mass_to_volume_15c(mass, density_15c),
+        density_15c=density_15c,
+        vcf=factors,
+    )
@@ -1,7 +1,27 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import xlsxwriter
 
 from odoo import api, fields, models, _, tools
 from odoo.exceptions import ValidationError
+from odoo.osv import expression
+
+_logger = logging.getLogger(__name__)
+
+REPORT_FETCH_BATCH_SIZE = 2000
+# statements a partition is filled with, see _get_fill_queries
+REPORT_FILL_STEPS = 10
+# rows per XLSX worksheet, the header excluded
+EXPORT_XLSX_MAX_ROWS = 1048575
 
 
 class Stock15CMovesWizard(models.TransientModel):
@@ -13,103 +33,349 @@ class Stock15CMovesWizard(models.TransientModel):
         string="Company",
         default=lambda self: self.env.user.company_id.id,
     )
+    company_ids = fields.Many2many("res.company", string="Companies")
+    warehouse_ids = fields.Many2many("stock.warehouse", string="Warehouses")
     start_date = fields.Date(string="Start Date")
     end_date = fields.Date(string="End Date")
+    run_in_background = fields.Boolean(
+        string="Run in background",
+        help="Prepare the report in the background, you are notified when it "
+        "is ready. Long periods are always prepared in the background.",
+    )
+    export_format = fields.Selection(
+        [("xlsx", "XLSX"), ("csv", "CSV")],
+        string="Export Format",
+        default="xlsx",
+    )
 
     def check_date_range(self):
         if self.end_date < self.start_date:
             raise ValidationError(_("End Date should be greater than Start Date."))
 
-    def fill_moves_data(self, unique_id):
-        self.env["stock.15c.moves.report"].sudo().search(
-            [("uid", "=", unique_id)]
-        ).unlink()
+    def _get_partitions(self):
+        """Return the ``(company, warehouse)`` pairs the report is made of,
+        each one is aggregated by its own statement. Without warehouses, a
+        partition covers all the internal locations of a company."""
+        self.ensure_one()
+        if self.warehouse_ids:
+            return [(warehouse.company_id, warehouse) for warehouse in self.warehouse_ids]
+        return [
+            (company, self.env["stock.warehouse"])
+            for company in (self.company_ids or self.company_id)
+        ]
+
+    def _get_moves_query(self, company=None, warehouse=None, location_ids=None):
+        """Return the ``(sql, params)`` of the query aggregating the 15C
+        balances of the wizard period, one row per product/location/lot, for
+        the internal locations of ``company`` (or of ``warehouse`` only,
+        restricted to ``location_ids`` if given).
+
+        Opening balances start from the latest balance snapshot taken on or
+        before the start date, so only the move lines dated after it are
+        read."""
+        self.ensure_one()
+        company = company or self.company_id
+        snapshot_date = self.env["stock.15c.balance.snapshot"]._get_snapshot_date(
+            company, self.start_date
+        )
         sql = """
-            with 
+            with
                 locations as (
-                    select id, complete_name as name
+                    select id
                     from stock_location
-                    where stock_location.company_id=%s and stock_location.usage='internal'
+                    where company_id = %(company_id)s
+                        and usage = 'internal'
+                        and (%(parent_path)s is null or parent_path like %(parent_path)s)
+                        and (%(location_ids)s is null or id = any(%(location_ids)s))
                 ),
-                moves as (
-                    select 
-                        sml.product_id, 
-                        sml.id as move_id,
-                        sml.date,
-                        sml.lot_id as lot_id,
-                        sml.location_dest_id as location_id,
-                        locations.name,
-                        case when (location_dest_id=locations.id and sml.date < %s) then sml.biko_product_qty_15c_done else 0 end as qty_start,
-                        case when (location_dest_id=locations.id and sml.date >=%s and sml.date <%s) then sml.biko_product_qty_15c_done else 0 end as qty_plus,
-                        0 as qty_minus,
-                        case when (location_dest_id=locations.id and sml.date <%s) then sml.biko_product_qty_15c_done else 0 end as qty_end
-                    from locations
-                    left join stock_move_line as sml on (sml.location_dest_id=locations.id)
-                    UNION ALL
-                    select 
-                        sml.product_id, 
-                        sml.move_id,
-                        sml.date,
+                lines as (
+                    select
+                        sml.product_id,
                         sml.lot_id,
                         sml.location_id,
-                        locations.name,
-                        case when (location_id=locations.id  and sml.date <%s) then -sml.biko_product_qty_15c_done else 0 end,
-                        0,
-                        case when (location_id=locations.id and sml.date >=%s and sml.date <%s) then -sml.biko_product_qty_15c_done else 0 end,
-                        case when (location_id=locations.id  and sml.date <%s) then -sml.biko_product_qty_15c_done else 0 end
+                        sml.location_dest_id,
+                        sml.date,
+                        sml.biko_product_qty_15c_done as qty
                     from stock_move_line as sml
-                    right join locations on (sml.location_id=locations.id)
+                    where sml.state = 'done'
+                        and sml.date < %(end_date)s
+                        and (%(snapshot_date)s is null or sml.date >= %(snapshot_date)s)
+                        and (
+                            sml.location_id in (select id from locations)
+                            or sml.location_dest_id in (select id from locations)
+                        )
+                ),
+                moves as (
+                    select
+                        lines.product_id,
+                        lines.lot_id,
+                        side.location_id,
+                        case when lines.date < %(start_date)s then side.qty else 0 end as qty_start,
+                        case when lines.date >= %(start_date)s and side.direction = 'in' then side.qty else 0 end as qty_in,
+                        case when lines.date >= %(start_date)s and side.direction = 'out' then side.qty else 0 end as qty_out,
+                        side.qty as qty_end
+                    from lines
+                    cross join lateral (
+                        values
+                            (lines.location_dest_id, lines.qty, 'in'),
+                            (lines.location_id, -lines.qty, 'out')
+                    ) as side (location_id, qty, direction)
+                    where side.location_id in (select id from locations)
+                    union all
+                    select
+                        snapshot.product_id,
+                        snapshot.lot_id,
+                        snapshot.location_id,
+                        snapshot.quantity,
+                        0,
+                        0,
+                        snapshot.quantity
+                    from stock_15c_balance_snapshot as snapshot
+                    where snapshot.company_id = %(company_id)s
+                        and snapshot.date = %(snapshot_date)s
+                        and snapshot.location_id in (select id from locations)
                 )
+            select
+                moves.product_id,
+                moves.location_id,
+                moves.lot_id,
+                pt.categ_id as category_id,
+                sum(moves.qty_start) as qty_start,
+                sum(moves.qty_in) as qty_in,
+                sum(moves.qty_out) as qty_out,
+                sum(moves.qty_end) as qty_end
+            from moves
+            join product_product as pp on (pp.id = moves.product_id)
+            join product_template as pt on (pt.id = pp.product_tmpl_id)
+            group by moves.product_id, moves.location_id, moves.lot_id, pt.categ_id
+        """
+        params = {
+            "company_id": company.id,
+            "parent_path": warehouse.view_location_id.parent_path + "%"
+            if warehouse
+            else None,
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "snapshot_date": snapshot_date,
+            "location_ids": location_ids,
+        }
+        return sql, params
 
-                select 
-                    moves.product_id, 
-                    moves.location_id, 
-                    moves.lot_id,
-                    products.categ_id as category_id,
-                    sum(moves.qty_start) as qty_start,
-                    sum(moves.qty_plus) as qty_in,
-                    sum(moves.qty_minus) as qty_out,
-                    sum(moves.qty_end) as qty_end
-                from moves
-                left join (
-                    select 
-                        pp.id as prod_id, 
-                        pt.categ_id as categ_id 
-                    from product_product as pp
-                    left join product_template as pt on (pp.product_tmpl_id=pt.id)
-                ) as products on (moves.product_id = products.prod_id)
-                where moves.product_id is not null
-                group by (moves.product_id,moves.location_id,moves.lot_id,products.categ_id)
+    def _iter_query(self, sql, params, batch_size=REPORT_FETCH_BATCH_SIZE):
+        """Yield the rows of ``sql`` as dicts, fetching them from a
+        server-side cursor ``batch_size`` rows at a time so the whole result
+        is never held in memory."""
+        cursor_name = "biko_15c_moves_%s" % uuid.uuid4().hex
+        self.env.cr.execute(
+            "declare %s no scroll cursor for %s" % (cursor_name, sql), params
+        )
+        try:
+            while True:
+                self.env.cr.execute(
+                    "fetch forward %s from %s" % (int(batch_size), cursor_name)
+                )
+                rows = self.env.cr.dictfetchall()
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            self.env.cr.execute("close %s" % cursor_name)
 
+    def _flush_moves_data(self):
+        self.env["stock.move.line"].flush(
+            [
+                "product_id",
+                "lot_id",
+                "location_id",
+                "location_dest_id",
+                "date",
+                "state",
+                "biko_product_qty_15c_done",
+            ]
+        )
+
+    def _get_fill_location_chunks(self, company, warehouse):
+        """Split the internal locations of a partition into (at most)
+        ``REPORT_FILL_STEPS`` chunks, filled by separate statements so that
+        the progress of a single partition can be followed."""
+        domain = [("company_id", "=", company.id), ("usage", "=", "internal")]
+        if warehouse:
+            domain.append(("id", "child_of", warehouse.view_location_id.id))
+        # archived locations keep their moves, as in the report query
+        location_ids = (
+            self.env["stock.location"]
+            .sudo()
+            .with_context(active_test=False)
+            .search(domain, order="id")
+            .ids
+        )
+        size = -(-len(location_ids) // REPORT_FILL_STEPS)
+        return [
+            location_ids[index : index + size]
+            for index in range(0, len(location_ids), size or 1)
+        ]
+
+    def _get_fill_queries(self, unique_id):
+        """Return the ``INSERT ... SELECT`` statements filling the report, a
+        few per partition. The rows of each statement are disjoint (they are
+        keyed by location), so they can be run in any order."""
+        queries = []
+        for company, warehouse in self._get_partitions():
+            for location_ids in self._get_fill_location_chunks(company, warehouse):
+                queries.append(
+                    self._get_fill_query(unique_id, company, warehouse, location_ids)
+                )
+        return queries
+
+    def _get_fill_query(self, unique_id, company, warehouse, location_ids):
+        sql, params = self._get_moves_query(company, warehouse, location_ids)
+        return (
+            """
+            insert into stock_15c_moves_report (
+                uid,
+                product_id,
+                location_id,
+                lot_id,
+                category_id,
+                qty_start,
+                qty_in,
+                qty_out,
+                qty_end,
+                create_uid,
+                create_date,
+                write_uid,
+                write_date
+            )
+            select
+                %%(uid)s,
+                data.product_id,
+                data.location_id,
+                data.lot_id,
+                data.category_id,
+                data.qty_start,
+                data.qty_in,
+                data.qty_out,
+                data.qty_end,
+                %%(user_id)s,
+                now() at time zone 'UTC',
+                %%(user_id)s,
+                now() at time zone 'UTC'
+            from (%s) as data
+            """
+            % sql,
+            dict(params, uid=unique_id, user_id=self.env.uid),
+        )
+
+    def _get_fill_workers(self):
+        if self.env.registry.in_test_mode():
+            return 1
+        return int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("biko_fuel_excise.report_workers", 4)
+        )
+
+    def _fill_in_parallel(self, unique_id, queries, workers, progress_callback=None):
+        """Run ``queries`` concurrently, each one in its own cursor that is
+        committed when done. The workers only see the committed state of the
+        database, and their rows are not visible to the current transaction,
+        only to the next requests (e.g. the opened pivot).
+
+        The rows are deleted again if a worker fails, or if the current
+        transaction is rolled back, so no partial report is left behind."""
+        registry = self.env.registry
+
+        def execute(query):
+            with registry.cursor() as cr:
+                cr.execute(*query)
+                return cr.rowcount
+
+        def delete_rows():
+            with registry.cursor() as cr:
+                cr.execute(
+                    "delete from stock_15c_moves_report where uid = %s", (unique_id,)
+                )
+
+        self.env.cr.postrollback.add(delete_rows)
+        row_count = 0
+        with ThreadPoolExecutor(max_workers=min(workers, len(queries))) as executor:
+            futures = [executor.submit(execute, query) for query in queries]
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    row_count += future.result()
+                    if progress_callback:
+                        progress_callback(done, len(queries))
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                # the other workers may have committed their partition
+                executor.shutdown(wait=True)
+                delete_rows()
+                raise
+        return row_count
+
+    def fill_moves_data(self, unique_id, progress_callback=None):
+        """Materialize the report rows for ``unique_id`` with a few
+        ``INSERT ... SELECT`` per company or warehouse, so the aggregated rows
+        never travel through Python and the ORM. Several statements are run
+        concurrently.
+
+        :param progress_callback: called with the number of statements run
+            and the total number of statements after each one
         """
-        result = self.env.cr.execute(
-            sql,
-            (
-                self.company_id.id,
-                self.start_date,
-                self.start_date,
-                self.end_date,
-                self.end_date,
-                self.start_date,
-                self.start_date,
-                self.end_date,
-                self.end_date,
-            ),
-        )
-
-        data = self.env.cr.dictfetchall()
-
-        for item in data:
-            item.update({"uid": unique_id})
-            self.env["stock.15c.moves.report"].sudo().create(item)
+        start_time = time.time()
+        self._flush_moves_data()
+        self.env.cr.execute(
+            "delete from stock_15c_moves_report where uid = %s", (unique_id,)
+        )
+        queries = self._get_fill_queries(unique_id)
+        workers = self._get_fill_workers()
+        if len(queries) > 1 and workers > 1:
+            row_count = self._fill_in_parallel(
+                unique_id, queries, workers, progress_callback
+            )
+        else:
+            row_count = 0
+            for done, query in enumerate(queries, 1):
+                self.env.cr.execute(*query)
+                row_count += self.env.cr.rowcount
+                if progress_callback:
+                    progress_callback(done, len(queries))
+        self.env["stock.15c.moves.report"].invalidate_cache()
 
-    def open_report(self):
-        self.check_date_range()
+        _logger.info(
+            "Stock 15C moves report %s: %s rows filled by %s statement(s) in %.3f s",
+            unique_id,
+            row_count,
+            len(queries),
+            time.time() - start_time,
+        )
 
-        unique_id = uuid.uuid4().hex
-        self.fill_moves_data(unique_id)
+    def _get_moves_write_date(self):
+        """Return the last write date of the company move lines, any change
+        behind the report moves it forward."""
+        companies = self.env["res.company"].union(
+            *(company for company, warehouse in self._get_partitions())
+        )
+        self.env["stock.move.line"].flush(["company_id"])
+        self.env.cr.execute(
+            "select max(write_date) from stock_move_line where company_id in %s",
+            (tuple(companies.ids),),
+        )
+        return self.env.cr.fetchone()[0]
+
+    def _get_session_key(self):
+        self.ensure_one()
+        return "%s|%s|%s|%s|%s" % (
+            ",".join(str(company.id) for company, warehouse in self._get_partitions()),
+            ",".join(str(warehouse_id) for warehouse_id in self.warehouse_ids.ids),
+            self.start_date,
+            self.end_date,
+            self._get_moves_write_date(),
+        )
 
-        action = {
+    def _get_report_action(self, unique_id):
+        return {
             "name": "Stock 15C Moves",
             "type": "ir.actions.act_window",
             "view_mode": "pivot",
@@ -119,4 +385,290 @@ class Stock15CMovesWizard(models.TransientModel):
             "domain": [("uid", "=", unique_id)],
         }
 
-        return action
+    def _get_session_values(self):
+        self.ensure_one()
+        return {
+            "company_id": self.company_id.id,
+            "company_ids": self.company_ids.ids,
+            "warehouse_ids": self.warehouse_ids.ids,
+            "start_date": fields.Date.to_string(self.start_date),
+            "end_date": fields.Date.to_string(self.end_date),
+        }
+
+    def _should_run_in_background(self):
+        self.ensure_one()
+        if self.run_in_background:
+            return True
+        max_days = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("biko_fuel_excise.report_background_days", 92)
+        )
+        days = (self.end_date - self.start_date).days * len(self._get_partitions())
+        return days > max_days
+
+    def open_report(self):
+        self.check_date_range()
+
+        Session = self.env["stock.15c.moves.session"].sudo()
+        key = self._get_session_key()
+        session = Session._find(key)
+        if not session:
+            session = Session.create(
+                {
+                    "uid": uuid.uuid4().hex,
+                    "key": key,
+                    "company_id": self.company_id.id,
+                    "start_date": self.start_date,
+                    "end_date": self.end_date,
+                    "user_id": self.env.uid,
+                    "wizard_values": json.dumps(self._get_session_values()),
+                    "state": "pending",
+                }
+            )
+            if self._should_run_in_background():
+                session._schedule()
+            else:
+                self.fill_moves_data(session.uid)
+                session.state = "done"
+
+        if session.state != "done":
+            session._add_requester(self.env.user)
+            return session._get_pending_notification_action()
+        return self._get_report_action(session.uid)
+
+    # Export
+    def _get_export_columns(self):
+        return [
+            ("location", _("Location")),
+            ("product", _("Product")),
+            ("category", _("Category")),
+            ("lot", _("Lot")),
+            ("density_15c", _("Density at 15 C")),
+            ("qty_start", _("Start Quantity")),
+            ("qty_in", _("Quantity In")),
+            ("qty_out", _("Quantity Out")),
+            ("qty_end", _("End Quantity")),
+        ]
+
+    def _iter_export_rows(self):
+        """Yield the report rows with the names of the records they refer to,
+        as read from a server-side cursor."""
+        self.ensure_one()
+        self._flush_moves_data()
+        for company, warehouse in self._get_partitions():
+            sql, params = self._get_moves_query(company, warehouse)
+            export_sql = (
+                """
+                select
+                    location.complete_name as location,
+                    coalesce('[' || pp.default_code || '] ', '') || pt.name as product,
+                    category.complete_name as category,
+                    lot.name as lot,
+                    lot.biko_density_15c as density_15c,
+                    data.qty_start,
+                    data.qty_in,
+                    data.qty_out,
+                    data.qty_end
+                from (%s) as data
+                join stock_location as location on (location.id = data.location_id)
+                join product_product as pp on (pp.id = data.product_id)
+                join product_template as pt on (pt.id = pp.product_tmpl_id)
+                left join product_category as category on (category.id = data.category_id)
+                left join stock_production_lot as lot on (lot.id = data.lot_id)
+                order by location.complete_name, product, lot.name
+                """
+                % sql
+            )
+            yield from self._iter_query(export_sql, params)
+
+    def _write_export_file(self, path, columns, rows):
+        """Write ``rows`` to ``path`` in the export format, row by row."""
+        header = [label for name, label in columns]
+        if self.export_format == "csv":
+            with open(path, "w", newline="", encoding="utf-8") as export_file:
+                writer = csv.writer(export_file)
+                writer.writerow(header)
+                for row in rows:
+                    writer.writerow([row[name] for name, label in columns])
+            return
+
+        # constant_memory flushes each row to the file once the next one starts
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        sheet = None
+        row_index = EXPORT_XLSX_MAX_ROWS
+        for row in rows:
+            if row_index >= EXPORT_XLSX_MAX_ROWS:
+                sheet = workbook.add_worksheet()
+                sheet.write_row(0, 0, header)
+                row_index = 0
+            row_index += 1
+            sheet.write_row(row_index, 0, [row[name] for name, label in columns])
+        if sheet is None:
+            workbook.add_worksheet().write_row(0, 0, header)
+        workbook.close()
+
+    def _create_export_attachment(self, path, name, mimetype):
+        """Create an attachment from the file at ``path``. With the file
+        storage, the file is moved into the filestore instead of being read
+        into memory."""
+        IrAttachment = self.env["ir.attachment"]
+        values = {
+            "name": name,
+            "type": "binary",
+            "mimetype": mimetype,
+            "res_model": self._name,
+            "res_id": self.id,
+        }
+        if IrAttachment._storage() != "file":
+            with open(path, "rb") as export_file:
+                attachment = IrAttachment.create(dict(values, raw=export_file.read()))
+            os.unlink(path)
+            return attachment
+
+        sha = hashlib.sha1()
+        with open(path, "rb") as export_file:
+            for chunk in iter(lambda: export_file.read(1024 * 1024), b""):
+                sha.update(chunk)
+        checksum = sha.hexdigest()
+        fname = "%s/%s" % (checksum[:2], checksum)
+        full_path = IrAttachment._full_path(fname)
+        file_size = os.path.getsize(path)
+        if os.path.isfile(full_path):
+            os.unlink(path)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            shutil.move(path, full_path)
+        # removed by the filestore garbage collector if the transaction is
+        # rolled back, like the files written by ir.attachment itself
+        IrAttachment._mark_for_gc(fname)
+
+        # create() drops store_fname, checksum and file_size from its values,
+        # they are set on the created (empty) attachment instead
+        attachment = IrAttachment.create(values)
+        attachment.flush()
+        self.env.cr.execute(
+            """
+            update ir_attachment
+            set store_fname = %s, checksum = %s, file_size = %s, mimetype = %s
+            where id = %s
+            """,
+            (fname, checksum, file_size, mimetype, attachment.id),
+        )
+        attachment.invalidate_cache(
+            ["store_fname", "checksum", "file_size", "mimetype", "raw", "datas"]
+        )
+        return attachment
+
+    def _export(self, name, columns, rows):
+        self.ensure_one()
+        start_time = time.time()
+        if self.export_format == "csv":
+            extension, mimetype = "csv", "text/csv"
+        else:
+            extension = "xlsx"
+            mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        handle, path = tempfile.mkstemp(
+            suffix=".%s" % extension, dir=self.env["ir.attachment"]._filestore()
+        )
+        os.close(handle)
+        try:
+            self._write_export_file(path, columns, rows)
+            attachment = self._create_export_attachment(
+                path, "%s.%s" % (name, extension), mimetype
+            )
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+        _logger.info(
+            "Stock 15C moves export %s: %s bytes in %.3f s",
+            attachment.name,
+            attachment.file_size,
+            time.time() - start_time,
+        )
+        return {
+            "type": "ir.actions.act_url",
+            "url": "/web/content/%s?download=true" % attachment.id,
+            "target": "self",
+        }
+
+    def action_export(self):
+        self.check_date_range()
+        name = "stock_15c_moves_%s_%s" % (self.start_date, self.end_date)
+        return self._export(name, self._get_export_columns(), self._iter_export_rows())
+
+    # Detail
+    def _get_detail_domain(self):
+        self.ensure_one()
+        partition_domains = []
+        for company, warehouse in self._get_partitions():
+            domain = [("company_id", "=", company.id)]
+            if warehouse:
+                domain.append(("location_id", "child_of", warehouse.view_location_id.id))
+            partition_domains.append(domain)
+        return expression.AND(
+            [
+                expression.OR(partition_domains),
+                [
+                    ("date", ">=", fields.Datetime.to_string(self.start_date)),
+                    ("date", "<", fields.Datetime.to_string(self.end_date)),
+                ],
+            ]
+        )
+
+    def open_detail(self):
+        self.check_date_range()
+        return {
+            "name": "Stock 15C Moves Detail",
+            "type": "ir.actions.act_window",
+            "view_mode": "tree",
+            "res_model": "stock.15c.moves.detail",
+            "view_id": self.env.ref("biko_fuel_excise.biko_stock15c_moves_detail_tree").id,
+            "domain": self._get_detail_domain(),
+        }
+
+    def _get_detail_export_columns(self):
+        return [
+            ("date", _("Date")),
+            ("reference", _("Reference")),
+            ("location_id", _("Location")),
+            ("counterpart_location_id", _("Counterpart Location")),
+            ("product_id", _("Product")),
+            ("lot_id", _("Lot")),
+            ("direction", _("Direction")),
+            ("qty_15c", _("Quantity at 15 C")),
+            ("density_15c", _("Density at 15 C")),
+            ("density_fact", _("Density")),
+        ]
+
+    def _iter_detail_rows(self, batch_size=REPORT_FETCH_BATCH_SIZE):
+        """Yield the detail rows page by page, each page located by the
+        ``(date, move_line_id, direction)`` key of the previous one."""
+        self.ensure_one()
+        self._flush_moves_data()
+        Detail = self.env["stock.15c.moves.detail"]
+        fields_list = [name for name, label in self._get_detail_export_columns()]
+        domain = self._get_detail_domain()
+        after = None
+        while True:
+            page = Detail.get_page(
+                domain, fields_list=fields_list, after=after, limit=batch_size
+            )
+            for record in page["records"]:
+                record["date"] = fields.Datetime.to_string(record["date"])
+                yield {
+                    name: value[1] if isinstance(value, tuple) else value
+                    for name, value in record.items()
+                }
+            # keep the memory bounded by the page size
+            Detail.invalidate_cache()
+            after = page["next"]
+            if not after:
+                break
+
+    def action_export_detail(self):
+        self.check_date_range()
+        name = "stock_15c_moves_detail_%s_%s" % (self.start_date, self.end_date)
+        return self._export(
+            name, self._get_detail_export_columns(), self._iter_detail_rows()
+        )